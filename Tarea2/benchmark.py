@@ -0,0 +1,186 @@
+"""Benchmarks y prueba de estrés de ListaVuelos.
+
+Uso (desde el directorio Tarea2):
+    python benchmark.py            # operaciones posicionales
+    python benchmark.py estres     # endpoints concurrentes desde muchos hilos
+    python benchmark.py motor      # engine por defecto vs. crear_engine (WAL y pragmas)
+"""
+import os
+import random
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from models import Base, Vuelo, ListaVuelos
+from database import crear_engine
+
+TAMANOS = [100, 1000, 5000, 20000, 50000]
+OPERACIONES = 200
+
+
+def crear_bd(n: int, url: str = "sqlite://", engine=None):
+    """Crea una BD con una cola enlazada de n vuelos y retorna su fábrica de sesiones."""
+    engine = engine or create_engine(url)
+    Base.metadata.create_all(bind=engine)
+    fabrica = sessionmaker(bind=engine)
+    with fabrica() as session:
+        session.bulk_insert_mappings(Vuelo, [
+            {
+                "id": i,
+                "codigo": f"BM{i}",
+                "estado": "programado",
+                "hora": datetime(2025, 1, 1),
+                "origen": "BOG",
+                "destino": "MAD",
+                "anterior_id": i - 1 if i > 1 else None,
+                "siguiente_id": i + 1 if i < n else None,
+                "en_cola": True,
+            }
+            for i in range(1, n + 1)
+        ])
+        session.commit()
+    return fabrica
+
+
+def nuevo_vuelo(codigo: str) -> Vuelo:
+    return Vuelo(codigo=codigo, estado="programado", hora=datetime(2025, 1, 1),
+                 origen="BOG", destino="MAD")
+
+
+def medir_posicionales(n: int, indexada: bool) -> float:
+    """Tiempo medio (ms) de un par insertar_en_posicion/extraer_de_posicion."""
+    lista = ListaVuelos(crear_bd(n), indexada=indexada)
+    rng = random.Random(n)
+    posiciones = [rng.randrange(1, n - 1) for _ in range(OPERACIONES)]
+
+    inicio = time.perf_counter()
+    for i, posicion in enumerate(posiciones):
+        lista.insertar_en_posicion(nuevo_vuelo(f"NUEVO{i}"), posicion)
+        lista.extraer_de_posicion(posicion)
+    transcurrido = time.perf_counter() - inicio
+
+    return transcurrido * 1000 / OPERACIONES
+
+
+def benchmark_posicionales():
+    print("Operaciones posicionales (ms por insertar+extraer en posición aleatoria)")
+    print(f"{'n':>8} {'enlazada':>10} {'indexada':>10}")
+    for n in TAMANOS:
+        enlazada = medir_posicionales(n, indexada=False)
+        indexada = medir_posicionales(n, indexada=True)
+        print(f"{n:>8} {enlazada:>10.3f} {indexada:>10.3f}")
+
+
+def verificar_integridad(lista: ListaVuelos):
+    """Comprueba enlaces, tamaño e índices de la lista contra la BD."""
+    adelante = []
+    nodo = lista.cabeza
+    while nodo:
+        assert nodo.siguiente is None or nodo.siguiente.anterior is nodo, "enlace roto"
+        adelante.append(nodo.id)
+        nodo = nodo.siguiente
+    atras = []
+    nodo = lista.cola
+    while nodo:
+        atras.append(nodo.id)
+        nodo = nodo.anterior
+
+    assert adelante == atras[::-1], "recorridos hacia adelante y atrás difieren"
+    assert len(adelante) == lista.size == len(lista._nodos_por_id), "tamaño inconsistente"
+    if lista._indice:
+        for posicion, vuelo_id in enumerate(adelante):
+            assert lista._nodo_en_posicion(posicion).id == vuelo_id, "índice posicional desfasado"
+
+    recargada = ListaVuelos(lista.fabrica_sesiones, orden_por_posicion=lista.orden_por_posicion)
+    assert [v.id for v in recargada.listar_todos()] == adelante, "la BD no coincide con la memoria"
+    return len(adelante)
+
+
+def estres(hilos: int = 16, operaciones: int = 100):
+    """Golpea los endpoints desde muchos hilos y verifica la integridad de la lista."""
+    # main.py usa ./vuelos.db: trabajar en un directorio temporal
+    os.chdir(tempfile.mkdtemp())
+    from fastapi.testclient import TestClient
+    import main
+
+    with TestClient(main.app):
+        def trabajador(numero: int):
+            cliente = TestClient(main.app)
+            rng = random.Random(numero)
+            errores = 0
+            for i in range(operaciones):
+                vuelo = {"codigo": f"H{numero}-{i}", "estado": rng.choice(["programado", "emergencia"]),
+                         "hora": "2025-01-01T10:00:00", "origen": "BOG", "destino": "MAD"}
+                total = cliente.get("/vuelos/total").json()
+                opcion = rng.random()
+                if opcion < 0.3:
+                    respuesta = cliente.post("/vuelos", json=vuelo)
+                elif opcion < 0.5:
+                    respuesta = cliente.post("/vuelos/insertar", json=vuelo,
+                                             params={"posicion": rng.randint(0, total)})
+                elif opcion < 0.65 and total:
+                    respuesta = cliente.delete("/vuelos/extraer",
+                                               params={"posicion": rng.randrange(total)})
+                elif opcion < 0.75:
+                    respuesta = cliente.get("/vuelos/proximo")
+                else:
+                    respuesta = cliente.get("/vuelos/lista")
+                # Una posición que quedó fuera de rango por otros hilos es un 400
+                if respuesta.status_code >= 500:
+                    errores += 1
+            return errores
+
+        inicio = time.perf_counter()
+        with ThreadPoolExecutor(hilos) as ejecutor:
+            errores = sum(ejecutor.map(trabajador, range(hilos)))
+        transcurrido = time.perf_counter() - inicio
+
+        tamano = verificar_integridad(main.lista_vuelos)
+    print(f"{hilos * operaciones} operaciones en {transcurrido:.1f}s desde {hilos} hilos; "
+          f"{errores} errores; lista íntegra con {tamano} vuelos")
+
+
+def medir_motor(engine, hilos: int, operaciones: int) -> float:
+    """Operaciones por segundo de hilos que mezclan inserciones en la lista y lecturas en BD."""
+    fabrica = crear_bd(1000, engine=engine)
+    lista = ListaVuelos(fabrica)
+
+    def trabajador(numero: int):
+        rng = random.Random(numero)
+        for i in range(operaciones):
+            if rng.random() < 0.5:
+                lista.insertar_al_final(nuevo_vuelo(f"M{numero}-{i}"))
+            else:
+                with fabrica() as session:
+                    session.query(Vuelo).filter(Vuelo.codigo == f"BM{rng.randint(1, 1000)}").first()
+
+    inicio = time.perf_counter()
+    with ThreadPoolExecutor(hilos) as ejecutor:
+        list(ejecutor.map(trabajador, range(hilos)))
+    transcurrido = time.perf_counter() - inicio
+    engine.dispose()
+    return hilos * operaciones / transcurrido
+
+
+def benchmark_motor(hilos: int = 8, operaciones: int = 200):
+    directorio = tempfile.mkdtemp()
+    por_defecto = medir_motor(create_engine(f"sqlite:///{directorio}/antes.db"), hilos, operaciones)
+    configurado = medir_motor(crear_engine(f"sqlite:///{directorio}/despues.db", trabajadores=hilos),
+                              hilos, operaciones)
+    print(f"Operaciones/s con {hilos} hilos (50% inserciones, 50% lecturas en BD)")
+    print(f"{'create_engine por defecto':<28} {por_defecto:>10.0f}")
+    print(f"{'crear_engine (WAL, pragmas)':<28} {configurado:>10.0f}")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "estres":
+        estres()
+    elif len(sys.argv) > 1 and sys.argv[1] == "motor":
+        benchmark_motor()
+    else:
+        benchmark_posicionales()
@@ -0,0 +1,37 @@
+import os
+from sqlalchemy import create_engine, event
+
+# Hilos que pueden usar una conexión a la vez en cada worker (por defecto,
+# el tamaño del threadpool de FastAPI/anyio)
+TRABAJADORES_POR_DEFECTO = int(os.environ.get("DB_TRABAJADORES", 40))
+
+def crear_engine(url: str, trabajadores: int = TRABAJADORES_POR_DEFECTO, wal: bool = True,
+                 synchronous: str = "NORMAL", mmap_size: int = 256 * 1024 * 1024,
+                 cache_size_kib: int = 64 * 1024, busy_timeout_ms: int = 5000):
+    """Crea un engine de SQLite configurado para varios lectores concurrentes.
+
+    En cada conexión nueva se activan WAL (los lectores no esperan al
+    escritor), synchronous=NORMAL (sin fsync por commit en modo WAL),
+    lectura por mmap, un caché de páginas más grande y un busy_timeout
+    para que los escritores esperen el lock en vez de fallar. El pool se
+    dimensiona para `trabajadores` conexiones simultáneas.
+    """
+    argumentos = {"connect_args": {"check_same_thread": False, "timeout": busy_timeout_ms / 1000}}
+    en_memoria = url in ("sqlite://", "sqlite:///:memory:")
+    if not en_memoria:
+        argumentos.update(pool_size=trabajadores, max_overflow=0)
+    engine = create_engine(url, **argumentos)
+
+    @event.listens_for(engine, "connect")
+    def configurar_conexion(conexion_dbapi, _registro):
+        cursor = conexion_dbapi.cursor()
+        if wal and not en_memoria:
+            cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute(f"PRAGMA synchronous={synchronous}")
+        cursor.execute(f"PRAGMA mmap_size={mmap_size}")
+        # Un valor negativo indica el tamaño en KiB en lugar de páginas
+        cursor.execute(f"PRAGMA cache_size=-{cache_size_kib}")
+        cursor.execute(f"PRAGMA busy_timeout={busy_timeout_ms}")
+        cursor.close()
+
+    return engine
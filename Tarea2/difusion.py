@@ -0,0 +1,63 @@
+import asyncio
+import threading
+
+class Difusor:
+    """Reparte mensajes ya serializados a los suscriptores de un flujo.
+
+    Se puede publicar desde cualquier hilo. Cada suscriptor es una
+    asyncio.Queue de su event loop y por cada mensaje se programa una sola
+    llamada por loop, que encola el mismo objeto en todas sus colas: el
+    costo de serializar no depende de la cantidad de suscriptores.
+
+    Un suscriptor que acumula `capacidad` mensajes sin leer se descarta y
+    recibe None, para cerrar su conexión en vez de retener memoria; el
+    cliente puede reconectarse y volver a leer la lista.
+    """
+
+    def __init__(self, capacidad: int = 256):
+        self.capacidad = capacidad
+        # event loop → colas de sus suscriptores
+        self._suscriptores = {}
+        self._lock = threading.Lock()
+
+    def suscribir(self) -> asyncio.Queue:
+        """Crea la cola de un suscriptor; se llama desde su event loop."""
+        loop = asyncio.get_running_loop()
+        # Un lugar extra para el None de desconexión
+        cola = asyncio.Queue(self.capacidad + 1)
+        with self._lock:
+            self._suscriptores.setdefault(loop, set()).add(cola)
+        return cola
+
+    def desuscribir(self, cola: asyncio.Queue):
+        with self._lock:
+            for loop, colas in list(self._suscriptores.items()):
+                colas.discard(cola)
+                if not colas:
+                    del self._suscriptores[loop]
+
+    def __len__(self):
+        with self._lock:
+            return sum(len(colas) for colas in self._suscriptores.values())
+
+    def publicar(self, mensaje):
+        """Entrega `mensaje` a todos los suscriptores actuales."""
+        with self._lock:
+            loops = list(self._suscriptores)
+        for loop in loops:
+            try:
+                loop.call_soon_threadsafe(self._repartir, loop, mensaje)
+            except RuntimeError:
+                # El loop ya se cerró: sus suscriptores no volverán a leer
+                with self._lock:
+                    self._suscriptores.pop(loop, None)
+
+    def _repartir(self, loop, mensaje):
+        with self._lock:
+            colas = list(self._suscriptores.get(loop, ()))
+        for cola in colas:
+            if cola.qsize() >= self.capacidad:
+                self.desuscribir(cola)
+                cola.put_nowait(None)
+            else:
+                cola.put_nowait(mensaje)
@@ -4,4 +4,8 @@ class VueloException(Exception):
 
 class OwnEmpty(VueloException):
     """Excepción para cuando la lista está vacía"""
+    pass
+
+class ListaDesactualizada(VueloException):
+    """Excepción para cuando otro proceso modificó la lista antes de confirmar"""
     pass
\ No newline at end of file
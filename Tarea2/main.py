@@ -1,12 +1,18 @@
-from fastapi import FastAPI, HTTPException, Body, Query, Depends
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker, Session
-from pydantic import BaseModel
-from typing import List, Optional
-from datetime import datetime
+from fastapi import FastAPI, HTTPException, Body, Query, BackgroundTasks, Request, Response
+from fastapi.responses import StreamingResponse
+from fastapi.encoders import jsonable_encoder
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy.orm import sessionmaker
+from pydantic import BaseModel, validator
+from typing import List, Optional, Literal
+from datetime import datetime, timezone
+import asyncio
+import json
 import logging
 
-from models import Base, Vuelo, EstadoVuelo, ListaVuelos
+from models import Base, Vuelo, EstadoVuelo, ListaVuelos, asegurar_esquema
+from database import crear_engine
+from difusion import Difusor
 
 # Configuración de logs
 logging.basicConfig(level=logging.INFO)
@@ -14,14 +20,38 @@ logger = logging.getLogger(__name__)
 
 # Configuración de la base de datos
 DATABASE_URL = "sqlite:///./vuelos.db"
-engine = create_engine(DATABASE_URL)
+SNAPSHOT_PATH = "./vuelos.snapshot"
+# Persistir el orden con claves en Vuelo.posicion en lugar de enlaces
+ORDEN_POR_POSICION = False
+# Activar al correr varios workers (uvicorn --workers N) sobre la misma BD:
+# cada proceso sincroniza su lista con los cambios confirmados por los demás
+LISTA_COMPARTIDA = False
+# Mantener un montículo por (prioridad, hora, llegada) para /vuelos/proximo?prioridad=true
+PLANIFICAR_POR_PRIORIDAD = True
+# Mantener las horas ordenadas en memoria para /vuelos/ventana
+INDICE_HORARIO = True
+# Agrupar en memoria los vuelos por origen y destino para los tableros de aeropuerto
+INDICE_AEROPUERTOS = True
+# WAL, pragmas y pool dimensionado en database.crear_engine
+engine = crear_engine(DATABASE_URL)
 Base.metadata.create_all(bind=engine)
+asegurar_esquema(engine)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 app = FastAPI(title="Sistema de Gestión de Vuelos")
 
 # Variables globales
 lista_vuelos = None
+# Reparte los cambios de la lista a los clientes de /vuelos/stream
+difusor = Difusor()
+# Segundos sin cambios tras los que se envía un comentario para mantener la conexión
+INTERVALO_PING = 15
+
+def hora_utc(hora: Optional[datetime]) -> Optional[datetime]:
+    """Convierte una hora con zona horaria a UTC sin zona, como las que guarda SQLite."""
+    if hora is not None and hora.tzinfo is not None:
+        hora = hora.astimezone(timezone.utc).replace(tzinfo=None)
+    return hora
 
 # Modelos Pydantic para la API
 class VueloBase(BaseModel):
@@ -30,6 +60,8 @@ class VueloBase(BaseModel):
     hora: datetime
     origen: str
     destino: str
+    
+    _hora_utc = validator("hora", allow_reuse=True)(hora_utc)
 
 class VueloResponse(VueloBase):
     id: int
@@ -37,34 +69,98 @@ class VueloResponse(VueloBase):
     class Config:
         orm_mode = True
 
+def campos_vuelo(vuelo: Vuelo) -> dict:
+    """Campos de VueloResponse de un vuelo, listos para json.dumps."""
+    campos = ("codigo", "estado", "hora", "origen", "destino", "id")
+    return jsonable_encoder({campo: getattr(vuelo, campo) for campo in campos})
+
+def serializar_vuelo(vuelo: Vuelo) -> str:
+    """Serializa un vuelo en JSON con los campos de VueloResponse."""
+    return json.dumps(campos_vuelo(vuelo))
+
+class ActualizacionVuelo(BaseModel):
+    estado: Optional[EstadoVuelo] = None
+    hora: Optional[datetime] = None
+    
+    _hora_utc = validator("hora", allow_reuse=True)(hora_utc)
+
 class OrdenVuelos(BaseModel):
     orden_ids: List[int]
-
-# Dependencia para obtener la sesión de la BD
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
+    desde: Optional[int] = None  # Reordenar solo el tramo que empieza aquí
 
 # Inicialización de la lista de vuelos
 @app.on_event("startup")
 def startup_db_client():
     global lista_vuelos
-    session = SessionLocal()
-    lista_vuelos = ListaVuelos(session)
+    # La lista abre una sesión propia por operación
+    lista_vuelos = ListaVuelos(SessionLocal, ruta_snapshot=SNAPSHOT_PATH,
+                               orden_por_posicion=ORDEN_POR_POSICION,
+                               compartida=LISTA_COMPARTIDA,
+                               planificada=PLANIFICAR_POR_PRIORIDAD,
+                               indice_horario=INDICE_HORARIO,
+                               indice_aeropuertos=INDICE_AEROPUERTOS)
+    lista_vuelos.oyentes.append(publicar_cambios)
     logger.info("Aplicación iniciada - Lista de vuelos cargada desde la BD")
 
 @app.on_event("shutdown")
 def shutdown_db_client():
-    if lista_vuelos and lista_vuelos.session:
-        lista_vuelos.session.close()
-        logger.info("Aplicación cerrada - Sesión de BD cerrada")
+    if lista_vuelos:
+        lista_vuelos.guardar_snapshot()
+        logger.info("Aplicación cerrada - Snapshot de la lista guardado")
+
+def publicar_cambios(version: int, eventos: List[dict]):
+    """Serializa una sola vez los cambios de una versión como evento SSE y lo difunde.
+
+    Los vuelos insertados o actualizados se leen de la BD solo si hay
+    suscriptores, en una sola consulta.
+    """
+    if not eventos or not len(difusor):
+        return
+    ids = {e["vuelo_id"] for e in eventos if e["operacion"] in ("insertar", "actualizar")}
+    vuelos = {}
+    if ids:
+        with SessionLocal() as db:
+            vuelos = {v.id: campos_vuelo(v) for v in db.query(Vuelo).filter(Vuelo.id.in_(ids))}
+    datos = {
+        "version": version,
+        "cambios": [
+            {**evento, "vuelo": vuelos[evento["vuelo_id"]]} if evento.get("vuelo_id") in vuelos else evento
+            for evento in eventos
+        ],
+    }
+    difusor.publicar(f"id: {version}\nevent: cambios\ndata: {json.dumps(datos)}\n\n".encode())
+
+def programar_rebalanceo(background_tasks: BackgroundTasks):
+    """Agenda la redistribución de claves de posición si los huecos se agotaron."""
+    if lista_vuelos.necesita_rebalanceo:
+        background_tasks.add_task(lista_vuelos.rebalancear)
+
+def etag_lista() -> str:
+    """ETag de las lecturas de la cola: la versión de la lista.
+
+    Se lee antes que los datos, así una respuesta nunca queda etiquetada
+    con una versión más nueva que su contenido.
+    """
+    return f'"{lista_vuelos.version_actual()}"'
+
+def sin_cambios(request: Request, etag: str) -> Optional[Response]:
+    """Retorna un 304 si el ETag coincide con alguno de If-None-Match."""
+    etiquetas = request.headers.get("if-none-match")
+    if not etiquetas:
+        return None
+    # If-None-Match usa comparación débil: se ignora el prefijo W/
+    if etiquetas.strip() == "*" or etag in (e.strip().removeprefix("W/") for e in etiquetas.split(",")):
+        return Response(status_code=304, headers={"ETag": etag, "Cache-Control": "no-cache"})
+    return None
+
+def etiquetar(response: Response, etag: str):
+    response.headers["ETag"] = etag
+    # Los clientes pueden guardar la respuesta pero deben revalidarla
+    response.headers["Cache-Control"] = "no-cache"
 
 # Endpoints según los requisitos
 @app.post("/vuelos", response_model=VueloResponse)
-def agregar_vuelo(vuelo_data: VueloBase, db: Session = Depends(get_db)):
+def agregar_vuelo(vuelo_data: VueloBase, background_tasks: BackgroundTasks):
     """Añade un vuelo al final (normal) o al frente (emergencia)."""
     try:
         logger.info(f"Añadiendo vuelo: {vuelo_data.codigo} - Estado: {vuelo_data.estado}")
@@ -77,11 +173,8 @@ def agregar_vuelo(vuelo_data: VueloBase, db: Session = Depends(get_db)):
             destino=vuelo_data.destino
         )
         
-        db.add(nuevo_vuelo)
-        db.commit()
-        db.refresh(nuevo_vuelo)
-        
-        # Añadir a la lista enlazada según su prioridad
+        # Añadir a la lista enlazada según su prioridad (el vuelo y sus
+        # enlaces se guardan en una sola transacción)
         if vuelo_data.estado == EstadoVuelo.EMERGENCIA:
             lista_vuelos.insertar_al_frente(nuevo_vuelo)
             logger.info(f"Vuelo de emergencia {nuevo_vuelo.codigo} añadido al frente")
@@ -89,9 +182,9 @@ def agregar_vuelo(vuelo_data: VueloBase, db: Session = Depends(get_db)):
             lista_vuelos.insertar_al_final(nuevo_vuelo)
             logger.info(f"Vuelo regular {nuevo_vuelo.codigo} añadido al final")
             
+        programar_rebalanceo(background_tasks)
         return nuevo_vuelo
     except Exception as e:
-        db.rollback()
         logger.error(f"Error al añadir vuelo: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Error al agregar vuelo: {str(e)}")
 
@@ -101,78 +194,243 @@ def obtener_total_vuelos():
     return lista_vuelos.longitud()
 
 @app.get("/vuelos/proximo", response_model=VueloResponse)
-def obtener_proximo_vuelo():
-    """Retorna el primer vuelo sin remover."""
-    vuelo = lista_vuelos.obtener_primero()
+def obtener_proximo_vuelo(request: Request, response: Response, prioridad: bool = False):
+    """Retorna el primer vuelo sin remover; con prioridad=true, el de mayor
+    prioridad según emergencia y hora en lugar del primero de la lista."""
+    etag = etag_lista()
+    no_modificado = sin_cambios(request, etag)
+    if no_modificado:
+        return no_modificado
+    
+    if prioridad:
+        try:
+            vuelo = lista_vuelos.obtener_proximo_prioritario()
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+    else:
+        vuelo = lista_vuelos.obtener_primero()
     if not vuelo:
         raise HTTPException(status_code=404, detail="No hay vuelos en la lista")
+    etiquetar(response, etag)
     return vuelo
 
 @app.get("/vuelos/ultimo", response_model=VueloResponse)
-def obtener_ultimo_vuelo():
+def obtener_ultimo_vuelo(request: Request, response: Response):
     """Retorna el último vuelo sin remover."""
+    etag = etag_lista()
+    no_modificado = sin_cambios(request, etag)
+    if no_modificado:
+        return no_modificado
+    
     vuelo = lista_vuelos.obtener_ultimo()
     if not vuelo:
         raise HTTPException(status_code=404, detail="No hay vuelos en la lista")
+    etiquetar(response, etag)
     return vuelo
 
 @app.post("/vuelos/insertar", response_model=VueloResponse)
-def insertar_vuelo_en_posicion(vuelo_data: VueloBase, posicion: int = Query(..., ge=0), db: Session = Depends(get_db)):
+def insertar_vuelo_en_posicion(vuelo_data: VueloBase, background_tasks: BackgroundTasks, posicion: int = Query(..., ge=0)):
     """Inserta un vuelo en una posición específica."""
+    nuevo_vuelo = Vuelo(
+        codigo=vuelo_data.codigo,
+        estado=vuelo_data.estado.value,
+        hora=vuelo_data.hora,
+        origen=vuelo_data.origen,
+        destino=vuelo_data.destino
+    )
+    
+    # El rango se valida dentro de la lista, con el lock tomado
     try:
-        if posicion > lista_vuelos.longitud():
-            raise HTTPException(status_code=400, detail=f"Posición {posicion} fuera de rango (0-{lista_vuelos.longitud()})")
-        
-        nuevo_vuelo = Vuelo(
-            codigo=vuelo_data.codigo,
-            estado=vuelo_data.estado.value,
-            hora=vuelo_data.hora,
-            origen=vuelo_data.origen,
-            destino=vuelo_data.destino
-        )
-        
-        db.add(nuevo_vuelo)
-        db.commit()
-        db.refresh(nuevo_vuelo)
-        
         lista_vuelos.insertar_en_posicion(nuevo_vuelo, posicion)
-        logger.info(f"Vuelo {nuevo_vuelo.codigo} insertado en posición {posicion}")
-        return nuevo_vuelo
+    except HTTPException:
+        raise
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
-        db.rollback()
         logger.error(f"Error al insertar vuelo en posición: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Error al insertar vuelo: {str(e)}")
+    logger.info(f"Vuelo {nuevo_vuelo.codigo} insertado en posición {posicion}")
+    programar_rebalanceo(background_tasks)
+    return nuevo_vuelo
 
 @app.delete("/vuelos/extraer", response_model=VueloResponse)
 def extraer_vuelo_de_posicion(posicion: int = Query(..., ge=0)):
     """Remueve un vuelo de una posición dada."""
+    # El rango se valida dentro de la lista, con el lock tomado
     try:
-        if posicion >= lista_vuelos.longitud():
-            raise HTTPException(status_code=400, detail=f"Posición {posicion} fuera de rango (0-{lista_vuelos.longitud()-1})")
-        
         vuelo = lista_vuelos.extraer_de_posicion(posicion)
-        logger.info(f"Vuelo {vuelo.codigo} extraído de posición {posicion}")
-        return vuelo
+    except HTTPException:
+        raise
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         logger.error(f"Error al extraer vuelo: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Error al extraer vuelo: {str(e)}")
+    logger.info(f"Vuelo {vuelo.codigo} extraído de posición {posicion}")
+    return vuelo
 
 @app.get("/vuelos/lista", response_model=List[VueloResponse])
-def listar_todos_los_vuelos():
-    """Lista todos los vuelos en orden actual."""
-    return lista_vuelos.listar_todos()
+def listar_todos_los_vuelos(
+    request: Request,
+    response: Response,
+    despues_de: Optional[int] = Query(None, description="Id del último vuelo de la página anterior"),
+    offset: int = Query(0, ge=0),
+    limite: Optional[int] = Query(None, ge=1),
+    formato: Literal["json", "ndjson"] = "json",
+):
+    """Lista los vuelos en orden actual, paginados o como flujo NDJSON.
+
+    Con If-None-Match y la lista sin cambios responde 304 sin recorrerla.
+    """
+    etag = etag_lista()
+    no_modificado = sin_cambios(request, etag)
+    if no_modificado:
+        return no_modificado
+    
+    try:
+        vuelos = lista_vuelos.recorrer(despues_de, offset, limite)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    if formato == "ndjson":
+        lineas = (serializar_vuelo(vuelo) + "\n" for vuelo in vuelos)
+        respuesta = StreamingResponse(lineas, media_type="application/x-ndjson")
+        etiquetar(respuesta, etag)
+        return respuesta
+    etiquetar(response, etag)
+    return list(vuelos)
 
 @app.patch("/vuelos/reordenar", response_model=List[VueloResponse])
-def reordenar_vuelos(orden: OrdenVuelos):
+def reordenar_vuelos(orden: OrdenVuelos, background_tasks: BackgroundTasks):
     """Reordena manualmente la cola (por ejemplo, por retrasos)."""
     try:
-        return lista_vuelos.reordenar(orden.orden_ids)
+        vuelos = lista_vuelos.reordenar(orden.orden_ids, orden.desde)
+        programar_rebalanceo(background_tasks)
+        return vuelos
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         logger.error(f"Error al reordenar vuelos: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Error al reordenar vuelos: {str(e)}")
 
+@app.get("/vuelos/ventana", response_model=List[VueloResponse])
+def listar_vuelos_en_ventana(desde: datetime, hasta: datetime):
+    """Lista los vuelos en cola que salen entre `desde` y `hasta`, ordenados por hora."""
+    desde, hasta = hora_utc(desde), hora_utc(hasta)
+    if desde > hasta:
+        raise HTTPException(status_code=400, detail="`desde` debe ser anterior a `hasta`")
+    return lista_vuelos.vuelos_en_ventana(desde, hasta)
+
+@app.get("/vuelos/origen/{codigo}", response_model=List[VueloResponse])
+def listar_vuelos_por_origen(codigo: str):
+    """Lista los vuelos en cola que salen del aeropuerto `codigo`, en el orden de la cola."""
+    return lista_vuelos.vuelos_por_origen(codigo)
+
+@app.get("/vuelos/destino/{codigo}", response_model=List[VueloResponse])
+def listar_vuelos_por_destino(codigo: str):
+    """Lista los vuelos en cola que llegan al aeropuerto `codigo`, en el orden de la cola."""
+    return lista_vuelos.vuelos_por_destino(codigo)
+
+@app.get("/vuelos/stream")
+async def transmitir_cambios():
+    """Flujo Server-Sent Events con los cambios de la cola.
+
+    Primero envía la versión actual de la lista (la del ETag de
+    /vuelos/lista) y luego un evento `cambios` por versión confirmada, con
+    la versión como id. Los cambios con versión menor o igual a la inicial
+    ya están incluidos en la lista de esa versión.
+    """
+    cola = difusor.suscribir()
+    try:
+        version = await run_in_threadpool(lista_vuelos.version_actual)
+    except Exception:
+        difusor.desuscribir(cola)
+        raise
+    
+    async def eventos():
+        try:
+            yield f"id: {version}\nevent: version\ndata: {json.dumps({'version': version})}\n\n".encode()
+            while True:
+                try:
+                    mensaje = await asyncio.wait_for(cola.get(), INTERVALO_PING)
+                except asyncio.TimeoutError:
+                    yield b": ping\n\n"
+                    continue
+                if mensaje is None:
+                    # Cliente demasiado lento: cerrar para que se reconecte
+                    return
+                yield mensaje
+        finally:
+            difusor.desuscribir(cola)
+    
+    return StreamingResponse(eventos(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.get("/vuelos/codigo/{codigo}", response_model=VueloResponse)
+def obtener_vuelo_por_codigo(codigo: str):
+    """Retorna un vuelo de la cola por su código."""
+    vuelo = lista_vuelos.obtener_por_codigo(codigo)
+    if not vuelo:
+        raise HTTPException(status_code=404, detail=f"El vuelo {codigo} no está en la lista")
+    return vuelo
+
+@app.get("/vuelos/{vuelo_id}", response_model=VueloResponse)
+def obtener_vuelo(vuelo_id: int):
+    """Retorna un vuelo de la cola por su id."""
+    vuelo = lista_vuelos.obtener_por_id(vuelo_id)
+    if not vuelo:
+        raise HTTPException(status_code=404, detail=f"El vuelo {vuelo_id} no está en la lista")
+    return vuelo
+
+@app.delete("/vuelos/{vuelo_id}", response_model=VueloResponse)
+def extraer_vuelo(vuelo_id: int):
+    """Remueve un vuelo de la cola por su id (ej: cancelación)."""
+    try:
+        vuelo = lista_vuelos.extraer_por_id(vuelo_id)
+    except Exception as e:
+        logger.error(f"Error al extraer vuelo: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Error al extraer vuelo: {str(e)}")
+    if not vuelo:
+        raise HTTPException(status_code=404, detail=f"El vuelo {vuelo_id} no está en la lista")
+    logger.info(f"Vuelo {vuelo.codigo} extraído por id")
+    return vuelo
+
+@app.patch("/vuelos/{vuelo_id}", response_model=VueloResponse)
+def actualizar_vuelo(vuelo_id: int, cambios: ActualizacionVuelo):
+    """Cambia el estado o la hora de un vuelo en cola (ej: retraso)."""
+    campos = {}
+    if cambios.estado is not None:
+        campos["estado"] = cambios.estado.value
+    if cambios.hora is not None:
+        campos["hora"] = cambios.hora
+    if not campos:
+        raise HTTPException(status_code=400, detail="No se indicó estado ni hora")
+    try:
+        vuelo = lista_vuelos.actualizar_vuelo(vuelo_id, **campos)
+    except Exception as e:
+        logger.error(f"Error al actualizar vuelo: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Error al actualizar vuelo: {str(e)}")
+    if not vuelo:
+        raise HTTPException(status_code=404, detail=f"El vuelo {vuelo_id} no está en la lista")
+    logger.info(f"Vuelo {vuelo.codigo} actualizado: {campos}")
+    return vuelo
+
+@app.patch("/vuelos/{vuelo_id}/mover", response_model=VueloResponse)
+def mover_vuelo(vuelo_id: int, background_tasks: BackgroundTasks, posicion: int = Query(..., ge=0)):
+    """Mueve un vuelo de la cola a otra posición."""
+    try:
+        vuelo = lista_vuelos.mover(vuelo_id, posicion)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error(f"Error al mover vuelo: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Error al mover vuelo: {str(e)}")
+    if not vuelo:
+        raise HTTPException(status_code=404, detail=f"El vuelo {vuelo_id} no está en la lista")
+    logger.info(f"Vuelo {vuelo.codigo} movido a posición {posicion}")
+    programar_rebalanceo(background_tasks)
+    return vuelo
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)
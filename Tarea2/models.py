@@ -1,10 +1,20 @@
+import heapq
+import os
+from bisect import bisect_left, bisect_right, insort
+import random
+import struct
+import time
+from array import array
 from enum import Enum
-from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, create_engine
+from sqlalchemy import Column, Integer, String, DateTime, Boolean, ForeignKey, create_engine, update, insert, delete, select, inspect, text
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship, sessionmaker
 from datetime import datetime
-from typing import Optional, List, Any
-from exceptions import OwnEmpty
+from typing import Optional, List, Any, Iterator
+from contextlib import contextmanager
+from exceptions import OwnEmpty, ListaDesactualizada
+from concurrencia import LockLectorEscritor
 
 Base = declarative_base()
 
@@ -19,281 +29,1494 @@ class Vuelo(Base):
     id = Column(Integer, primary_key=True, index=True)
     codigo = Column(String, unique=True, index=True)
     estado = Column(String)
-    hora = Column(DateTime)
-    origen = Column(String)
-    destino = Column(String)
-    posicion = Column(Integer, nullable=True)
+    hora = Column(DateTime, index=True)
+    origen = Column(String, index=True)
+    destino = Column(String, index=True)
+    # Clave de orden dispersa (solo en el modo orden_por_posicion)
+    posicion = Column(Integer, nullable=True, index=True)
     
     # Para mantener la estructura de lista enlazada en la BD
     anterior_id = Column(Integer, ForeignKey('vuelos.id'), nullable=True)
     siguiente_id = Column(Integer, ForeignKey('vuelos.id'), nullable=True)
+    # Indica si el vuelo pertenece actualmente a la cola
+    en_cola = Column(Boolean, nullable=False, default=False, index=True)
+
+class EstadoLista(Base):
+    """Fila única con la versión de la lista; cada mutación la incrementa."""
+    __tablename__ = "estado_lista"
+    
+    id = Column(Integer, primary_key=True)
+    version = Column(Integer, nullable=False, default=0)
+
+class CambioLista(Base):
+    """Cambio confirmado en la lista; los demás workers lo aplican para ponerse al día."""
+    __tablename__ = "cambios_lista"
+    
+    id = Column(Integer, primary_key=True)
+    version = Column(Integer, nullable=False, index=True)
+    operacion = Column(String, nullable=False)  # insertar, extraer, reordenar, rebalancear
+    vuelo_id = Column(Integer, nullable=True)
+    posicion = Column(Integer, nullable=True)
+    clave = Column(Integer, nullable=True)
+
+def asegurar_esquema(engine):
+    """Agrega a una BD existente las columnas e índices que create_all no añade."""
+    columnas = {c["name"] for c in inspect(engine).get_columns("vuelos")}
+    
+    with engine.begin() as conexion:
+        if "en_cola" not in columnas:
+            _migrar_en_cola(conexion)
+        conexion.execute(text("CREATE INDEX IF NOT EXISTS ix_vuelos_posicion ON vuelos (posicion)"))
+        conexion.execute(text("CREATE INDEX IF NOT EXISTS ix_vuelos_hora ON vuelos (hora)"))
+        conexion.execute(text("CREATE INDEX IF NOT EXISTS ix_vuelos_origen ON vuelos (origen)"))
+        conexion.execute(text("CREATE INDEX IF NOT EXISTS ix_vuelos_destino ON vuelos (destino)"))
+        # Sembrar la versión aquí evita que varios workers la creen a la vez
+        conexion.execute(text("INSERT OR IGNORE INTO estado_lista (id, version) VALUES (1, 0)"))
+
+def _migrar_en_cola(conexion):
+    """Agrega la columna en_cola marcando los vuelos alcanzables desde la cabeza."""
+    conexion.execute(text("ALTER TABLE vuelos ADD COLUMN en_cola BOOLEAN NOT NULL DEFAULT 0"))
+    conexion.execute(text("CREATE INDEX IF NOT EXISTS ix_vuelos_en_cola ON vuelos (en_cola)"))
+    
+    filas = conexion.execute(text("SELECT id, anterior_id, siguiente_id FROM vuelos")).all()
+    if not filas:
+        return
+    siguientes = {fila.id: fila.siguiente_id for fila in filas}
+    actual = next((fila.id for fila in filas if fila.anterior_id is None), filas[0].id)
+    miembros = set()
+    while actual in siguientes and actual not in miembros:
+        miembros.add(actual)
+        actual = siguientes[actual]
+    conexion.execute(text("UPDATE vuelos SET en_cola = 1 WHERE id = :id"),
+                     [{"id": vuelo_id} for vuelo_id in miembros])
 
 class Nodo:
-    """Nodo para la lista doblemente enlazada."""
+    """Nodo para la lista doblemente enlazada.
+
+    Puede crearse solo con el id del vuelo; el objeto Vuelo se carga
+    la primera vez que se accede a `vuelo`, usando `cargador`.
+    """
     
-    def __init__(self, vuelo: Vuelo):
-        self.vuelo = vuelo
+    def __init__(self, vuelo: Optional[Vuelo] = None, vuelo_id: Optional[int] = None, cargador=None):
+        self.id = vuelo.id if vuelo is not None else vuelo_id
+        self.codigo = vuelo.codigo if vuelo is not None else None
+        self._vuelo = vuelo
+        self._cargador = cargador
+        self.clave = None  # Clave de orden en el modo orden_por_posicion
         self.anterior = None
         self.siguiente = None
+        # Campos del índice posicional (IndicePosiciones)
+        self._izq = None
+        self._der = None
+        self._padre = None
+        self._tamano = 1
+        self._prioridad = 0.0
+    
+    @property
+    def vuelo(self) -> Vuelo:
+        if self._vuelo is None:
+            self._vuelo = self._cargador(self.id)
+        return self._vuelo
+
+class IndicePosiciones:
+    """Árbol de estadísticas de orden (treap implícito) sobre los nodos de la lista.
+
+    Cada nodo guarda el tamaño de su subárbol, así ubicar, insertar o remover
+    un nodo por posición cuesta O(log n) esperado en lugar de recorrer la lista.
+    """
+
+    def __init__(self):
+        self.raiz = None
+
+    @staticmethod
+    def _tamano(nodo: Optional[Nodo]) -> int:
+        return nodo._tamano if nodo else 0
+
+    def _actualizar(self, nodo: Nodo):
+        nodo._tamano = 1 + self._tamano(nodo._izq) + self._tamano(nodo._der)
+
+    def _rotar(self, nodo: Nodo):
+        """Sube un nodo un nivel rotándolo con su padre."""
+        padre = nodo._padre
+        abuelo = padre._padre
+        if padre._izq is nodo:
+            padre._izq = nodo._der
+            if nodo._der:
+                nodo._der._padre = padre
+            nodo._der = padre
+        else:
+            padre._der = nodo._izq
+            if nodo._izq:
+                nodo._izq._padre = padre
+            nodo._izq = padre
+        padre._padre = nodo
+        nodo._padre = abuelo
+        if abuelo is None:
+            self.raiz = nodo
+        elif abuelo._izq is padre:
+            abuelo._izq = nodo
+        else:
+            abuelo._der = nodo
+        self._actualizar(padre)
+        self._actualizar(nodo)
+
+    def vaciar(self):
+        self.raiz = None
+
+    def obtener(self, posicion: int) -> Nodo:
+        """Retorna el nodo en la posición dada."""
+        actual = self.raiz
+        while actual:
+            izq = self._tamano(actual._izq)
+            if posicion < izq:
+                actual = actual._izq
+            elif posicion == izq:
+                return actual
+            else:
+                posicion -= izq + 1
+                actual = actual._der
+        raise IndexError(f"Posición {posicion} fuera del índice")
+
+    def insertar(self, nodo: Nodo, posicion: int):
+        """Inserta el nodo para que quede en la posición dada."""
+        nodo._izq = nodo._der = nodo._padre = None
+        nodo._tamano = 1
+        nodo._prioridad = random.random()
+        if self.raiz is None:
+            self.raiz = nodo
+            return
+
+        actual = self.raiz
+        while True:
+            actual._tamano += 1
+            izq = self._tamano(actual._izq)
+            if posicion <= izq:
+                if actual._izq is None:
+                    actual._izq = nodo
+                    break
+                actual = actual._izq
+            else:
+                posicion -= izq + 1
+                if actual._der is None:
+                    actual._der = nodo
+                    break
+                actual = actual._der
+        nodo._padre = actual
+
+        # Restaurar la propiedad de heap sobre las prioridades
+        while nodo._padre and nodo._padre._prioridad < nodo._prioridad:
+            self._rotar(nodo)
+
+    def remover(self, nodo: Nodo):
+        """Remueve el nodo del índice."""
+        # Bajar el nodo hasta que tenga a lo sumo un hijo
+        while nodo._izq and nodo._der:
+            if nodo._izq._prioridad > nodo._der._prioridad:
+                self._rotar(nodo._izq)
+            else:
+                self._rotar(nodo._der)
+
+        hijo = nodo._izq or nodo._der
+        padre = nodo._padre
+        if hijo:
+            hijo._padre = padre
+        if padre is None:
+            self.raiz = hijo
+        elif padre._izq is nodo:
+            padre._izq = hijo
+        else:
+            padre._der = hijo
+
+        while padre:
+            padre._tamano -= 1
+            padre = padre._padre
+        nodo._izq = nodo._der = nodo._padre = None
+        nodo._tamano = 1
+
+    def posicion_de(self, nodo: Nodo) -> int:
+        """Retorna la posición actual de un nodo del índice."""
+        posicion = self._tamano(nodo._izq)
+        while nodo._padre:
+            if nodo._padre._der is nodo:
+                posicion += self._tamano(nodo._padre._izq) + 1
+            nodo = nodo._padre
+        return posicion
+
+class PlanificadorVuelos:
+    """Montículo binario de los vuelos en cola ordenados por (prioridad, hora, id).
+
+    Las emergencias van primero; dentro de cada clase manda la hora y, a
+    igual hora, el id (orden de llegada). Quitar un vuelo solo lo borra
+    del diccionario de claves vigentes: las entradas obsoletas se descartan
+    cuando llegan a la cima, que siempre queda vigente, así `proximo` es
+    O(1) y agregar/quitar O(log n) amortizado.
+
+    Como los demás índices por atributos, se carga desde filas proyectadas
+    (id, estado, hora, origen, destino), agrega el vuelo de un nodo y quita
+    solo por id, sin leer el vuelo.
+    """
+    
+    PRIORIDADES = {EstadoVuelo.EMERGENCIA: 0}
+    PRIORIDAD_NORMAL = 1
+    
+    def __init__(self):
+        self._monticulo = []
+        self._claves = {}
+    
+    def _clave(self, vuelo_id: int, vuelo):
+        prioridad = self.PRIORIDADES.get(vuelo.estado, self.PRIORIDAD_NORMAL)
+        return (prioridad, vuelo.hora or datetime.max, vuelo_id)
+    
+    def vaciar(self):
+        self._monticulo = []
+        self._claves = {}
+    
+    def cargar(self, filas):
+        self._claves = {fila.id: self._clave(fila.id, fila) for fila in filas}
+        self._monticulo = list(self._claves.values())
+        heapq.heapify(self._monticulo)
+    
+    def agregar(self, nodo: Nodo):
+        clave = self._clave(nodo.id, nodo.vuelo)
+        try:
+            heapq.heappush(self._monticulo, clave)
+        except Exception:
+            # Clave no comparable con las demás: sacarla del montículo
+            self._monticulo = [entrada for entrada in self._monticulo if entrada is not clave]
+            heapq.heapify(self._monticulo)
+            raise
+        self._claves[nodo.id] = clave
+    
+    def quitar(self, nodo: Nodo):
+        self._claves.pop(nodo.id, None)
+        # Compactar si las entradas obsoletas superan a las vigentes
+        if len(self._monticulo) > 2 * len(self._claves) + 64:
+            self._compactar()
+        self._limpiar_cima()
+    
+    def _compactar(self):
+        self._monticulo = list(self._claves.values())
+        heapq.heapify(self._monticulo)
+    
+    def _limpiar_cima(self):
+        while self._monticulo and self._claves.get(self._monticulo[0][2]) != self._monticulo[0]:
+            heapq.heappop(self._monticulo)
+    
+    def proximo(self) -> Optional[int]:
+        """Id del vuelo con mayor prioridad, o None si no hay vuelos."""
+        return self._monticulo[0][2] if self._monticulo else None
+    
+    def __len__(self):
+        return len(self._claves)
+
+class IndiceHorario:
+    """Claves (hora, id) de los vuelos en cola en un arreglo ordenado.
+
+    Las ventanas de tiempo se resuelven con dos búsquedas binarias:
+    O(log n + k) para k vuelos en el rango.
+    """
+    
+    def __init__(self):
+        self._claves = []
+        # Hora con que se indexó cada vuelo, para quitarlo sin leer el vuelo
+        self._horas = {}
+    
+    def vaciar(self):
+        self._claves = []
+        self._horas = {}
+    
+    def cargar(self, filas):
+        self._horas = {fila.id: fila.hora for fila in filas if fila.hora is not None}
+        self._claves = sorted((hora, vuelo_id) for vuelo_id, hora in self._horas.items())
+    
+    def agregar(self, nodo: Nodo):
+        hora = nodo.vuelo.hora
+        if hora is not None:
+            insort(self._claves, (hora, nodo.id))
+            self._horas[nodo.id] = hora
+    
+    def quitar(self, nodo: Nodo):
+        hora = self._horas.pop(nodo.id, None)
+        if hora is None:
+            return
+        clave = (hora, nodo.id)
+        i = bisect_left(self._claves, clave)
+        if i < len(self._claves) and self._claves[i] == clave:
+            del self._claves[i]
+    
+    def ventana(self, desde: datetime, hasta: datetime) -> List[int]:
+        """Ids de los vuelos con desde <= hora <= hasta, ordenados por hora."""
+        inicio = bisect_left(self._claves, (desde,))
+        fin = bisect_right(self._claves, (hasta, float("inf")))
+        return [vuelo_id for _, vuelo_id in self._claves[inicio:fin]]
+
+class IndiceAeropuertos:
+    """Ids de los vuelos en cola agrupados por aeropuerto de origen y de destino.
+
+    Cada grupo es un conjunto de ids sin orden: la posición en la lista se
+    resuelve al consultar, así reordenar la lista no toca el índice.
+    """
+    
+    def __init__(self):
+        self.por_origen = {}
+        self.por_destino = {}
+        # Aeropuertos con que se indexó cada vuelo, para quitarlo aunque cambien
+        self._aeropuertos = {}
+    
+    def vaciar(self):
+        self.por_origen = {}
+        self.por_destino = {}
+        self._aeropuertos = {}
+    
+    def cargar(self, filas):
+        self.vaciar()
+        for fila in filas:
+            self._agregar(fila.id, fila)
+    
+    def agregar(self, nodo: Nodo):
+        self._agregar(nodo.id, nodo.vuelo)
+    
+    def _agregar(self, vuelo_id: int, vuelo):
+        self._aeropuertos[vuelo_id] = (vuelo.origen, vuelo.destino)
+        self.por_origen.setdefault(vuelo.origen, set()).add(vuelo_id)
+        self.por_destino.setdefault(vuelo.destino, set()).add(vuelo_id)
+    
+    def quitar(self, nodo: Nodo):
+        aeropuertos = self._aeropuertos.pop(nodo.id, None)
+        if aeropuertos is None:
+            return
+        origen, destino = aeropuertos
+        self._sacar(self.por_origen, origen, nodo.id)
+        self._sacar(self.por_destino, destino, nodo.id)
+    
+    @staticmethod
+    def _sacar(grupos: dict, aeropuerto: str, vuelo_id: int):
+        grupo = grupos[aeropuerto]
+        grupo.discard(vuelo_id)
+        if not grupo:
+            del grupos[aeropuerto]
 
 class ListaVuelos:
-    """Implementación de una lista doblemente enlazada para la gestión de vuelos."""
+    """Implementación de una lista doblemente enlazada para la gestión de vuelos.
+
+    Con ``indexada=True`` los nodos se mantienen además en un IndicePosiciones,
+    de modo que las operaciones por posición cuestan O(log n) en vez de O(n).
+
+    Cada operación que modifica la lista acumula los cambios de punteros
+    (anterior_id/siguiente_id) y los confirma en una sola transacción.
+
+    Si se indica `ruta_snapshot`, cada `snapshot_cada` mutaciones se guarda
+    el orden de ids junto con la versión de la BD; al iniciar se carga ese
+    archivo directamente si su versión coincide con la de la BD.
+
+    Con ``orden_por_posicion=True`` el orden se persiste en `Vuelo.posicion`
+    con claves dispersas en lugar de anterior_id/siguiente_id: insertar o
+    extraer escribe solo la fila afectada y la carga es un ORDER BY posicion.
+    Cuando los huecos entre claves se agotan se marca `necesita_rebalanceo`
+    para que `rebalancear` redistribuya las claves en segundo plano.
+
+    La lista es segura entre hilos: las consultas comparten un lock de
+    lectura y las mutaciones toman el de escritura. Cada operación abre su
+    propia sesión con `fabrica_sesiones` (p. ej. un sessionmaker).
+
+    Con ``planificada=True`` se mantiene además un PlanificadorVuelos con
+    los mismos vuelos, para consultar el próximo vuelo por prioridad y hora
+    sin alterar el orden de la lista. Con ``indice_horario=True`` se mantiene
+    un IndiceHorario para consultar ventanas de tiempo sin ir a la BD, y con
+    ``indice_aeropuertos=True`` un IndiceAeropuertos para listar los vuelos
+    de un origen o destino sin recorrer toda la lista.
+
+    Con ``compartida=True`` varios procesos pueden mantener su propia copia
+    de la lista sobre la misma BD: cada transacción incrementa la versión de
+    `estado_lista` solo si sigue siendo la que conoce el proceso (bloqueo
+    optimista) y deja sus cambios en `cambios_lista`. Antes de cada operación
+    se compara la versión y, si avanzó, se aplican los cambios pendientes; si
+    el registro no alcanza o hubo un reordenamiento se recarga la lista.
+
+    Cada función de `oyentes` recibe, con el lock de escritura tomado, la
+    versión confirmada y sus eventos (ver `_notificar`), en orden de versión.
+    """
+    
+    # Cabecera del snapshot: firma, versión y cantidad de ids
+    FORMATO_SNAPSHOT = "<4sQI"
+    FIRMA_SNAPSHOT = b"LVS1"
+    
+    # Separación entre claves nuevas y hueco mínimo antes de pedir rebalanceo
+    ESPACIO_CLAVES = 1 << 16
+    UMBRAL_REBALANCEO = 16
     
-    def __init__(self, session):
+    # Modo compartido: versiones que se conservan en cambios_lista y
+    # reintentos de una mutación que perdió la carrera contra otro worker
+    RETENCION_CAMBIOS = 10000
+    REINTENTOS_CONFLICTO = 10
+    # Versión de una lista compartida que no se pudo cargar: nunca coincide
+    # con la de la BD, así la próxima operación vuelve a cargarla
+    VERSION_DESCONOCIDA = -1
+    
+    def __init__(self, fabrica_sesiones, indexada: bool = True,
+                 ruta_snapshot: Optional[str] = None, snapshot_cada: int = 100,
+                 orden_por_posicion: bool = False, compartida: bool = False,
+                 planificada: bool = False, indice_horario: bool = False,
+                 indice_aeropuertos: bool = False):
         self.cabeza = None
         self.cola = None
         self.size = 0
-        self.session = session
+        self.fabrica_sesiones = fabrica_sesiones
+        self.version = 0
+        self.orden_por_posicion = orden_por_posicion
+        self.necesita_rebalanceo = False
+        self.compartida = compartida
+        self.ruta_snapshot = None if orden_por_posicion else ruta_snapshot
+        self.snapshot_cada = snapshot_cada
+        self._mutaciones_sin_snapshot = 0
+        self._indice = IndicePosiciones() if indexada else None
+        self._nodos_por_id = {}
+        # Índice codigo → nodo; se construye en la primera búsqueda por código
+        self._nodos_por_codigo = None
+        # Índices por atributos del vuelo: se actualizan al enlazar/desenlazar
+        self.planificador = PlanificadorVuelos() if planificada else None
+        self.indice_horario = IndiceHorario() if indice_horario else None
+        self.indice_aeropuertos = IndiceAeropuertos() if indice_aeropuertos else None
+        self._indices = [
+            indice for indice in (self.planificador, self.indice_horario, self.indice_aeropuertos)
+            if indice is not None
+        ]
+        self._lock = LockLectorEscritor()
+        # Funciones oyente(version, eventos) llamadas tras cada versión confirmada
+        self.oyentes = []
+        # Estado de la transacción en curso (ver _transaccion)
+        self._sesion = None
+        self._pendientes = None
+        self._deshacer = None
+        self._cambios = None
         self._cargar_desde_bd()
     
     def _cargar_desde_bd(self):
-        """Inicializa la lista cargando datos desde la base de datos."""
+        """Inicializa la lista desde el snapshot o, si está desactualizado, desde la BD."""
         try:
-            # Obtener todos los vuelos ordenados por posición
-            vuelos = self.session.query(Vuelo).all()
-            
-            if not vuelos:
-                return  # Base de datos vacía
-            
-            # Construir diccionario id → vuelo
-            vuelos_dict = {v.id: v for v in vuelos}
-            
-            # Encontrar la cabeza (sin anterior_id)
-            cabeza = next((v for v in vuelos if v.anterior_id is None), None)
-            
-            if not cabeza:
-                # Si no hay una cabeza clara, usar el primer vuelo
-                cabeza = vuelos[0]
-                
-            # Reconstruir la lista
-            self.cabeza = Nodo(cabeza)
-            nodo_actual = self.cabeza
-            self.size = 1
-            
-            # Seguir los siguientes
-            siguiente_id = cabeza.siguiente_id
-            while siguiente_id and siguiente_id in vuelos_dict:
-                siguiente_vuelo = vuelos_dict[siguiente_id]
-                nuevo_nodo = Nodo(siguiente_vuelo)
-                
-                nuevo_nodo.anterior = nodo_actual
-                nodo_actual.siguiente = nuevo_nodo
-                
-                nodo_actual = nuevo_nodo
-                self.size += 1
-                
-                siguiente_id = siguiente_vuelo.siguiente_id
-            
-            self.cola = nodo_actual
+            with self.fabrica_sesiones() as session:
+                self._sesion = session
+                self.version = self._leer_version()
+                if self.orden_por_posicion:
+                    self._cargar_por_posicion()
+                elif not self._cargar_snapshot():
+                    self._cargar_cadena()
         except Exception as e:
             print(f"Error al cargar vuelos desde BD: {e}")
             # Empezar con lista vacía en caso de error
-            self.cabeza = None
-            self.cola = None
-            self.size = 0
+            self._reconstruir([])
+            if self.compartida:
+                # La lista vacía no corresponde a ninguna versión de la BD
+                self.version = self.VERSION_DESCONOCIDA
+        finally:
+            self._sesion = None
     
-    def _actualizar_bd(self, vuelo: Vuelo, anterior_id: Optional[int] = None, siguiente_id: Optional[int] = None):
-        """Actualiza las referencias de un vuelo en la base de datos."""
+    def _leer_version(self) -> int:
+        """Retorna la versión actual de la lista en BD (creando el registro si falta)."""
+        estado = self._sesion.get(EstadoLista, 1)
+        if estado is None:
+            try:
+                self._sesion.add(EstadoLista(id=1, version=0))
+                self._sesion.commit()
+            except IntegrityError:
+                # Otro proceso creó el registro primero
+                self._sesion.rollback()
+            estado = self._sesion.get(EstadoLista, 1)
+        return estado.version
+    
+    def _cargar_snapshot(self) -> bool:
+        """Carga la lista desde el snapshot; retorna False si no existe o está desactualizado."""
+        if not self.ruta_snapshot or not os.path.exists(self.ruta_snapshot):
+            return False
+        
+        ids = array("q")
         try:
-            if anterior_id is not None:
-                vuelo.anterior_id = anterior_id
-            if siguiente_id is not None:
-                vuelo.siguiente_id = siguiente_id
-                
-            self.session.add(vuelo)
-            self.session.commit()
-            return True
-        except Exception as e:
-            print(f"Error al actualizar vuelo en BD: {e}")
-            self.session.rollback()
+            with open(self.ruta_snapshot, "rb") as archivo:
+                cabecera = archivo.read(struct.calcsize(self.FORMATO_SNAPSHOT))
+                firma, version, cantidad = struct.unpack(self.FORMATO_SNAPSHOT, cabecera)
+                if firma != self.FIRMA_SNAPSHOT or version != self.version:
+                    return False
+                datos = archivo.read(cantidad * ids.itemsize + 1)
+                # Un archivo truncado o con bytes de más se descarta
+                if len(datos) != cantidad * ids.itemsize:
+                    return False
+                ids.frombytes(datos)
+        except (OSError, struct.error, ValueError) as e:
+            print(f"Snapshot ilegible, se reconstruye desde la BD: {e}")
             return False
+        
+        if self._sesion.query(Vuelo).filter(Vuelo.en_cola == True).count() != cantidad:
+            return False
+        
+        # Los vuelos se cargan bajo demanda
+        self._reconstruir([self._nuevo_nodo(vuelo_id=id) for id in ids])
+        return True
     
-    def insertar_al_frente(self, vuelo: Vuelo):
-        """Añade un vuelo al inicio de la lista (para emergencias)."""
-        nuevo_nodo = Nodo(vuelo)
+    def guardar_snapshot(self):
+        """Escribe el orden actual de ids y la versión en el archivo de snapshot."""
+        with self._lock.escritura():
+            self._guardar_snapshot()
+    
+    def _guardar_snapshot(self):
+        if not self.ruta_snapshot:
+            return
         
-        if self.cabeza is None:  # Lista vacía
-            self.cabeza = nuevo_nodo
-            self.cola = nuevo_nodo
-            self._actualizar_bd(vuelo, anterior_id=None, siguiente_id=None)
-        else:
-            nuevo_nodo.siguiente = self.cabeza
-            self.cabeza.anterior = nuevo_nodo
-            
-            # Actualizar referencias en BD
-            self._actualizar_bd(vuelo, anterior_id=None, siguiente_id=self.cabeza.vuelo.id)
-            self._actualizar_bd(self.cabeza.vuelo, anterior_id=vuelo.id)
+        ids = array("q")
+        nodo_actual = self.cabeza
+        while nodo_actual:
+            ids.append(nodo_actual.id)
+            nodo_actual = nodo_actual.siguiente
+        
+        # Escribir a un temporal y reemplazar, para no dejar archivos a medias
+        temporal = f"{self.ruta_snapshot}.{os.getpid()}.tmp"
+        with open(temporal, "wb") as archivo:
+            archivo.write(struct.pack(self.FORMATO_SNAPSHOT, self.FIRMA_SNAPSHOT,
+                                      self.version, len(ids)))
+            archivo.write(ids.tobytes())
+        os.replace(temporal, self.ruta_snapshot)
+        self._mutaciones_sin_snapshot = 0
+    
+    def _cargar_cadena(self):
+        """Reconstruye la lista siguiendo los enlaces siguiente_id de la BD.
+
+        Solo se consultan las columnas de enlace de los vuelos en cola; los
+        objetos Vuelo completos se cargan bajo demanda.
+        """
+        filas = (
+            self._sesion.query(Vuelo.id, Vuelo.anterior_id, Vuelo.siguiente_id)
+            .filter(Vuelo.en_cola == True)
+            .all()
+        )
+        
+        if not filas:
+            self._reconstruir([])
+            return  # Cola vacía
+        
+        # Construir diccionario id → siguiente_id
+        siguientes = {fila.id: fila.siguiente_id for fila in filas}
+        
+        # Encontrar la cabeza (sin anterior_id)
+        cabeza = next((fila.id for fila in filas if fila.anterior_id is None), None)
+        
+        if cabeza is None:
+            # Si no hay una cabeza clara, usar el primer vuelo
+            cabeza = filas[0].id
             
-            self.cabeza = nuevo_nodo
+        # Seguir los siguientes (evitando ciclos en datos corruptos)
+        nodos = []
+        visitados = set()
+        actual = cabeza
+        while actual in siguientes and actual not in visitados:
+            nodos.append(self._nuevo_nodo(vuelo_id=actual))
+            visitados.add(actual)
+            actual = siguientes[actual]
         
-        self.size += 1
-        return vuelo
+        self._reconstruir(nodos)
     
-    def insertar_al_final(self, vuelo: Vuelo):
-        """Añade un vuelo al final de la lista (vuelos regulares)."""
-        nuevo_nodo = Nodo(vuelo)
+    def _cargar_por_posicion(self):
+        """Reconstruye la lista con una sola consulta ordenada por la clave de posición."""
+        filas = (
+            self._sesion.query(Vuelo.id, Vuelo.posicion)
+            .filter(Vuelo.en_cola == True)
+            .order_by(Vuelo.posicion)
+            .all()
+        )
+        
+        if any(fila.posicion is None for fila in filas):
+            # Cola guardada con enlaces: reconstruirla y asignarle claves
+            self._cargar_cadena()
+            self.rebalancear()
+            return
+        
+        nodos = []
+        for fila in filas:
+            nodo = self._nuevo_nodo(vuelo_id=fila.id)
+            nodo.clave = fila.posicion
+            nodos.append(nodo)
+        self._reconstruir(nodos)
+    
+    def _nuevo_nodo(self, vuelo: Optional[Vuelo] = None, vuelo_id: Optional[int] = None) -> Nodo:
+        return Nodo(vuelo, vuelo_id, cargador=self._cargar_vuelo)
+    
+    def _cargar_vuelo(self, vuelo_id: int) -> Vuelo:
+        """Carga un vuelo completo desde la BD."""
+        with self.fabrica_sesiones() as session:
+            return session.get(Vuelo, vuelo_id)
+    
+    def _hidratar(self, nodos: List[Nodo]):
+        """Carga en bloque los vuelos de los nodos que aún no los tienen."""
+        faltantes = [nodo for nodo in nodos if nodo._vuelo is None]
+        if not faltantes:
+            return
+        
+        with self.fabrica_sesiones() as session:
+            for inicio in range(0, len(faltantes), 500):
+                bloque = faltantes[inicio:inicio + 500]
+                vuelos = {
+                    vuelo.id: vuelo
+                    for vuelo in session.query(Vuelo).filter(Vuelo.id.in_([n.id for n in bloque]))
+                }
+                for nodo in bloque:
+                    nodo._vuelo = vuelos.get(nodo.id)
+    
+    def _reconstruir(self, nodos: List[Nodo]):
+        """Rehace los enlaces (y el índice) a partir de una secuencia de nodos."""
+        anterior = None
+        for nodo in nodos:
+            nodo.anterior = anterior
+            if anterior:
+                anterior.siguiente = nodo
+            anterior = nodo
+        if anterior:
+            anterior.siguiente = None
+        
+        self.cabeza = nodos[0] if nodos else None
+        self.cola = anterior
+        self.size = len(nodos)
+        self._nodos_por_id = {nodo.id: nodo for nodo in nodos}
+        self._nodos_por_codigo = None
+        
+        if self._indice:
+            self._indice.vaciar()
+            for posicion, nodo in enumerate(nodos):
+                self._indice.insertar(nodo, posicion)
+        
+        if self._indices:
+            # Solo las columnas indexadas: los vuelos se siguen cargando bajo demanda
+            filas = [fila for fila in self._atributos_en_cola() if fila.id in self._nodos_por_id]
+            for indice in self._indices:
+                indice.cargar(filas)
+    
+    def _atributos_en_cola(self):
+        """Columnas que usan los índices por atributos, para todos los vuelos en cola."""
+        consulta = select(Vuelo.id, Vuelo.estado, Vuelo.hora, Vuelo.origen, Vuelo.destino).where(Vuelo.en_cola == True)
+        if self._sesion is not None:
+            return self._sesion.execute(consulta).all()
+        with self.fabrica_sesiones() as session:
+            return session.execute(consulta).all()
+    
+    def _indice_codigos(self) -> dict:
+        """Retorna el índice codigo → nodo, construyéndolo con una consulta proyectada."""
+        if self._nodos_por_codigo is None:
+            indice = {}
+            with self.fabrica_sesiones() as session:
+                filas = session.query(Vuelo.id, Vuelo.codigo).filter(Vuelo.en_cola == True).all()
+            for fila in filas:
+                nodo = self._nodos_por_id.get(fila.id)
+                if nodo:
+                    nodo.codigo = fila.codigo
+                    indice[fila.codigo] = nodo
+            self._nodos_por_codigo = indice
+        return self._nodos_por_codigo
+    
+    def _nodo_en_posicion(self, posicion: int) -> Nodo:
+        """Ubica el nodo en una posición: O(log n) con índice, O(n) sin él."""
+        if self._indice:
+            return self._indice.obtener(posicion)
         
-        if self.cola is None:  # Lista vacía
-            self.cabeza = nuevo_nodo
-            self.cola = nuevo_nodo
-            self._actualizar_bd(vuelo, anterior_id=None, siguiente_id=None)
+        # Sin índice se recorre desde el extremo más cercano
+        if posicion <= self.size // 2:
+            actual = self.cabeza
+            for _ in range(posicion):
+                actual = actual.siguiente
         else:
-            nuevo_nodo.anterior = self.cola
-            self.cola.siguiente = nuevo_nodo
-            
-            # Actualizar referencias en BD
-            self._actualizar_bd(vuelo, anterior_id=self.cola.vuelo.id, siguiente_id=None)
-            self._actualizar_bd(self.cola.vuelo, siguiente_id=vuelo.id)
-            
-            self.cola = nuevo_nodo
+            actual = self.cola
+            for _ in range(self.size - 1 - posicion):
+                actual = actual.anterior
+        return actual
+    
+    def _posicion_de(self, nodo: Nodo) -> int:
+        """Retorna la posición de un nodo de la lista."""
+        # Los extremos no necesitan índice ni recorrido
+        if nodo is self.cabeza:
+            return 0
+        if nodo is self.cola:
+            return self.size - 1
+        if self._indice:
+            return self._indice.posicion_de(nodo)
         
+        posicion = 0
+        while nodo.anterior:
+            nodo = nodo.anterior
+            posicion += 1
+        return posicion
+    
+    @contextmanager
+    def _transaccion(self):
+        """Agrupa los cambios de una operación y los confirma en un solo commit.
+
+        Si la confirmación falla se revierte la sesión y se deshacen los
+        enlaces en memoria, dejando la lista como antes de la operación.
+        """
+        sesion_previa = self._sesion
+        self._sesion = self.fabrica_sesiones()
+        # Los vuelos nuevos quedan en memoria después del commit
+        self._sesion.expire_on_commit = False
+        self._pendientes = {}
+        self._deshacer = []
+        # Los cambios solo se anotan si alguien los va a leer: cambios_lista
+        # en modo compartido o los oyentes
+        self._cambios = cambios = [] if self.compartida or self.oyentes else None
+        try:
+            yield
+            if self._pendientes:
+                self._sesion.bulk_update_mappings(Vuelo, [
+                    {"id": vuelo_id, **campos} for vuelo_id, campos in self._pendientes.items()
+                ])
+            self._confirmar_version()
+            self._sesion.commit()
+        except Exception:
+            self._sesion.rollback()
+            acciones = self._deshacer
+            # Las acciones de deshacer no deben registrar nuevos cambios
+            self._pendientes = None
+            self._deshacer = None
+            self._cambios = None
+            for accion in reversed(acciones):
+                accion()
+            raise
+        finally:
+            self._pendientes = None
+            self._deshacer = None
+            self._cambios = None
+            self._sesion.close()
+            self._sesion = sesion_previa
+        
+        self.version += 1
+        self._notificar(self.version, cambios or [])
+        self._mutaciones_sin_snapshot += 1
+        if self.ruta_snapshot and self._mutaciones_sin_snapshot >= self.snapshot_cada:
+            try:
+                self._guardar_snapshot()
+            except OSError as e:
+                print(f"Error al guardar snapshot: {e}")
+    
+    def _confirmar_version(self):
+        """Incrementa la versión en BD dentro de la transacción en curso.
+
+        En modo compartido el incremento exige que la versión siga siendo
+        la conocida y los cambios de la operación quedan en cambios_lista.
+        """
+        consulta = update(EstadoLista).where(EstadoLista.id == 1)
+        if not self.compartida:
+            self._sesion.execute(consulta.values(version=EstadoLista.version + 1))
+            return
+        
+        resultado = self._sesion.execute(
+            consulta.where(EstadoLista.version == self.version)
+            .values(version=EstadoLista.version + 1)
+        )
+        if resultado.rowcount == 0:
+            raise ListaDesactualizada(f"La lista cambió en otro proceso (versión local {self.version})")
+        
+        version = self.version + 1
+        if self._cambios:
+            self._sesion.execute(insert(CambioLista), [
+                {"version": version, **{k: v for k, v in cambio.items() if k != "ids"}}
+                for cambio in self._cambios
+            ])
+        if version % 100 == 0:
+            self._sesion.execute(
+                delete(CambioLista).where(CambioLista.version <= version - self.RETENCION_CAMBIOS)
+            )
+    
+    def _registrar_cambio(self, operacion: str, nodo: Optional[Nodo] = None, **datos):
+        """Anota un cambio de la transacción en curso para cambios_lista y los oyentes.
+
+        Fuera de una transacción que anote cambios no hace nada; en particular
+        la posición de un nodo insertado solo se calcula si se va a registrar.
+        """
+        if self._cambios is None:
+            return
+        cambio = {"operacion": operacion, "vuelo_id": None, "posicion": None, "clave": None}
+        if nodo is not None:
+            cambio["vuelo_id"] = nodo.id
+        if operacion == "insertar":
+            cambio["posicion"] = self._posicion_de(nodo)
+            cambio["clave"] = nodo.clave
+        cambio.update(datos)
+        self._cambios.append(cambio)
+    
+    def _notificar(self, version: int, cambios: List[dict]):
+        """Entrega a los oyentes los eventos de los cambios confirmados hasta `version`.
+
+        Cada evento tiene la operación y lo necesario para repetirla: el id
+        del vuelo (y la posición al insertar) o la posición y los ids nuevos
+        de un tramo reordenado. Los vuelos no se cargan aquí: el oyente que
+        los necesite los lee, así no se paga con el lock de escritura tomado
+        ni cuando nadie los usa. Los rebalanceos no cambian el orden y se
+        omiten.
+        """
+        if not self.oyentes:
+            return
+        eventos = []
+        for cambio in cambios:
+            operacion = cambio["operacion"]
+            if operacion == "rebalancear":
+                continue
+            if operacion in ("reordenar", "recargar"):
+                evento = {k: v for k, v in cambio.items() if k in ("operacion", "posicion", "ids")}
+            else:
+                evento = {"operacion": operacion, "vuelo_id": cambio["vuelo_id"]}
+                if operacion == "insertar":
+                    evento["posicion"] = cambio["posicion"]
+            eventos.append(evento)
+        
+        for oyente in self.oyentes:
+            try:
+                oyente(version, eventos)
+            except Exception as e:
+                print(f"Error al notificar cambios: {e}")
+    
+    def _version_en_bd(self) -> Optional[int]:
+        with self.fabrica_sesiones() as session:
+            return session.execute(
+                select(EstadoLista.version).where(EstadoLista.id == 1)
+            ).scalar()
+    
+    def _sincronizar(self):
+        """Aplica los cambios que otros procesos confirmaron desde self.version.
+
+        Requiere el lock de escritura. Si falta alguna versión en el registro
+        o alguna operación no se puede repetir localmente, recarga la lista.
+        """
+        if not self.compartida:
+            return
+        with self.fabrica_sesiones() as session:
+            version = session.execute(
+                select(EstadoLista.version).where(EstadoLista.id == 1)
+            ).scalar()
+            if version is None or version == self.version:
+                return
+            cambios = []
+            desconocida = self.version == self.VERSION_DESCONOCIDA
+            if not desconocida and 0 < version - self.version <= self.RETENCION_CAMBIOS:
+                cambios = session.execute(
+                    select(CambioLista.version, CambioLista.operacion, CambioLista.vuelo_id,
+                           CambioLista.posicion, CambioLista.clave)
+                    .where(CambioLista.version > self.version, CambioLista.version <= version)
+                    .order_by(CambioLista.id)
+                ).all()
+        
+        completo = {cambio.version for cambio in cambios} == set(range(self.version + 1, version + 1))
+        if desconocida or not completo or any(c.operacion not in ("insertar", "extraer", "actualizar") for c in cambios):
+            self._recargar()
+            return
+        
+        try:
+            self._aplicar_cambios(cambios)
+        except (KeyError, IndexError):
+            self._recargar()
+            return
+        self.version = version
+        self._notificar(version, [cambio._asdict() for cambio in cambios])
+    
+    def _recargar(self):
+        """Vuelve a cargar la lista completa y avisa a los oyentes si lo logró."""
+        self._cargar_desde_bd()
+        if self.version != self.VERSION_DESCONOCIDA:
+            self._notificar(self.version, [{"operacion": "recargar"}])
+    
+    def _aplicar_cambios(self, cambios):
+        """Repite en memoria inserciones, extracciones y actualizaciones ya confirmadas en BD."""
+        # Un vuelo movido se extrae y se vuelve a insertar: reutilizar su nodo
+        extraidos = {}
+        for cambio in cambios:
+            if cambio.operacion == "extraer":
+                nodo = self._nodos_por_id[cambio.vuelo_id]
+                self._desenlazar(nodo)
+                extraidos[nodo.id] = nodo
+            elif cambio.operacion == "actualizar":
+                # Volver a leer el vuelo desde la BD
+                nodo = self._nodos_por_id[cambio.vuelo_id]
+                self._quitar_de_indices(nodo)
+                nodo._vuelo = None
+                self._agregar_a_indices(nodo)
+            else:
+                nodo = extraidos.pop(cambio.vuelo_id, None) or self._nuevo_nodo(vuelo_id=cambio.vuelo_id)
+                if cambio.posicion > self.size:
+                    raise IndexError(cambio.posicion)
+                anterior = self._nodo_en_posicion(cambio.posicion - 1) if cambio.posicion > 0 else None
+                self._enlazar(nodo, anterior)
+                nodo.clave = cambio.clave
+        # Los nodos nuevos aún no conocen su código
+        self._nodos_por_codigo = None
+    
+    def _refrescar(self):
+        """En modo compartido, se pone al día antes de una consulta si la versión avanzó."""
+        if self.compartida and self._version_en_bd() != self.version:
+            with self._lock.escritura():
+                self._sincronizar()
+    
+    def _escribir(self, operacion):
+        """Ejecuta una mutación con el lock de escritura.
+
+        En modo compartido primero aplica los cambios de otros procesos y,
+        si otro proceso confirma antes, vuelve a intentarlo.
+        """
+        with self._lock.escritura():
+            for intento in range(self.REINTENTOS_CONFLICTO):
+                self._sincronizar()
+                try:
+                    return operacion()
+                except ListaDesactualizada:
+                    if intento == self.REINTENTOS_CONFLICTO - 1:
+                        raise
+                    # Espera aleatoria para no chocar de nuevo con el mismo proceso
+                    time.sleep(random.uniform(0, min(0.5, 0.005 * 2 ** intento)))
+    
+    def _actualizar_bd(self, vuelo_id: int, **campos):
+        """Registra cambios de columnas de un vuelo para la transacción en curso."""
+        if self._pendientes is not None:
+            self._pendientes.setdefault(vuelo_id, {}).update(campos)
+    
+    def _persistir_nuevo(self, vuelo: Vuelo):
+        """Agrega el vuelo a la sesión si aún no tiene id, sin confirmar."""
+        if inspect(vuelo).transient:
+            # Un intento revertido deja el id que había asignado la BD
+            vuelo.id = None
+            self._sesion.add(vuelo)
+            self._sesion.flush()
+    
+    def _enlazar(self, nodo: Nodo, anterior: Optional[Nodo]):
+        """Inserta un nodo después de `anterior` (al frente si es None).
+
+        Los índices por atributos van primero: si alguno falla, la lista
+        queda intacta. Desde que el nodo está enlazado, su deshacer queda
+        registrado antes de cualquier otro paso.
+        """
+        self._agregar_a_indices(nodo)
+        siguiente = anterior.siguiente if anterior else self.cabeza
+        
+        nodo.anterior = anterior
+        nodo.siguiente = siguiente
+        if anterior:
+            anterior.siguiente = nodo
+        else:
+            self.cabeza = nodo
+        if siguiente:
+            siguiente.anterior = nodo
+        else:
+            self.cola = nodo
+        
+        if self._indice:
+            posicion = self._indice.posicion_de(anterior) + 1 if anterior else 0
+            self._indice.insertar(nodo, posicion)
         self.size += 1
+        self._nodos_por_id[nodo.id] = nodo
+        if self._nodos_por_codigo is not None:
+            self._nodos_por_codigo[nodo.codigo] = nodo
+        if self._deshacer is not None:
+            self._deshacer.append(lambda: self._desenlazar(nodo))
+        
+        # Actualizar referencias en BD
+        vuelo_id = nodo.id
+        if self.orden_por_posicion:
+            self._actualizar_bd(vuelo_id, en_cola=True)
+            # Al deshacer una extracción el nodo conserva su clave anterior
+            if self._pendientes is not None:
+                self._asignar_claves([nodo])
+        else:
+            self._actualizar_bd(vuelo_id, en_cola=True,
+                                anterior_id=anterior.id if anterior else None,
+                                siguiente_id=siguiente.id if siguiente else None)
+            if anterior:
+                self._actualizar_bd(anterior.id, siguiente_id=vuelo_id)
+            if siguiente:
+                self._actualizar_bd(siguiente.id, anterior_id=vuelo_id)
+        
+        self._registrar_cambio("insertar", nodo)
+    
+    def _desenlazar(self, nodo: Nodo):
+        """Remueve un nodo de la lista (los índices por atributos primero, como en _enlazar)."""
+        self._quitar_de_indices(nodo)
+        anterior, siguiente = nodo.anterior, nodo.siguiente
+        
+        if anterior:
+            anterior.siguiente = siguiente
+        else:
+            self.cabeza = siguiente
+        if siguiente:
+            siguiente.anterior = anterior
+        else:
+            self.cola = anterior
+        nodo.anterior = None
+        nodo.siguiente = None
+        
+        if self._indice:
+            self._indice.remover(nodo)
+        self.size -= 1
+        del self._nodos_por_id[nodo.id]
+        if self._nodos_por_codigo is not None:
+            self._nodos_por_codigo.pop(nodo.codigo, None)
+        if self._deshacer is not None:
+            self._deshacer.append(lambda: self._enlazar(nodo, anterior))
+        
+        # Actualizar referencias en BD
+        if self.orden_por_posicion:
+            self._actualizar_bd(nodo.id, en_cola=False)
+        else:
+            self._actualizar_bd(nodo.id, en_cola=False, anterior_id=None, siguiente_id=None)
+            if anterior:
+                self._actualizar_bd(anterior.id,
+                                    siguiente_id=siguiente.id if siguiente else None)
+            if siguiente:
+                self._actualizar_bd(siguiente.id,
+                                    anterior_id=anterior.id if anterior else None)
+        
+        self._registrar_cambio("extraer", nodo)
+    
+    def _modificar_vuelo(self, nodo: Nodo, campos: dict):
+        """Cambia columnas del vuelo de un nodo y lo reubica en los índices."""
+        vuelo = nodo.vuelo
+        previos = {campo: getattr(vuelo, campo) for campo in campos}
+        self._quitar_de_indices(nodo)
+        for campo, valor in campos.items():
+            setattr(vuelo, campo, valor)
+        try:
+            self._agregar_a_indices(nodo)
+        except Exception:
+            # Los valores nuevos no entran en algún índice: volver a los previos
+            for campo, valor in previos.items():
+                setattr(vuelo, campo, valor)
+            self._agregar_a_indices(nodo)
+            raise
+        if self._deshacer is not None:
+            self._deshacer.append(lambda: self._modificar_vuelo(nodo, previos))
+        
+        self._actualizar_bd(nodo.id, **campos)
+        self._registrar_cambio("actualizar", nodo)
+    
+    def _agregar_a_indices(self, nodo: Nodo):
+        """Agrega el nodo a los índices por atributos; si uno falla, lo quita de los anteriores."""
+        agregados = []
+        try:
+            for indice in self._indices:
+                indice.agregar(nodo)
+                agregados.append(indice)
+        except Exception:
+            for indice in reversed(agregados):
+                indice.quitar(nodo)
+            raise
+    
+    def _quitar_de_indices(self, nodo: Nodo):
+        """Quita el nodo de los índices por atributos; si uno falla, lo repone en los anteriores."""
+        quitados = []
+        try:
+            for indice in self._indices:
+                indice.quitar(nodo)
+                quitados.append(indice)
+        except Exception:
+            for indice in reversed(quitados):
+                indice.agregar(nodo)
+            raise
+    
+    def _cambiar_clave(self, nodo: Nodo, clave: int):
+        """Asigna una clave de orden a un nodo y la registra para la transacción."""
+        clave_previa = nodo.clave
+        if clave_previa == clave:
+            return
+        nodo.clave = clave
+        self._actualizar_bd(nodo.id, posicion=clave)
+        if self._deshacer is not None:
+            self._deshacer.append(lambda: setattr(nodo, "clave", clave_previa))
+    
+    def _asignar_claves(self, nodos: List[Nodo]):
+        """Asigna claves a un tramo contiguo de nodos dentro del hueco de sus vecinos."""
+        menor = nodos[0].anterior.clave if nodos[0].anterior else None
+        mayor = nodos[-1].siguiente.clave if nodos[-1].siguiente else None
+        if menor is None and mayor is None:
+            menor = 0
+        if menor is None:
+            menor = mayor - self.ESPACIO_CLAVES * (len(nodos) + 1)
+        if mayor is None:
+            mayor = menor + self.ESPACIO_CLAVES * (len(nodos) + 1)
+        
+        paso = (mayor - menor) // (len(nodos) + 1)
+        if paso < 1:
+            # Sin hueco disponible: redistribuir todas las claves ahora
+            self._redistribuir_claves()
+            return
+        if paso < self.UMBRAL_REBALANCEO:
+            self.necesita_rebalanceo = True
+        for i, nodo in enumerate(nodos, start=1):
+            self._cambiar_clave(nodo, menor + paso * i)
+    
+    def _redistribuir_claves(self):
+        """Reparte las claves de todos los nodos de forma equiespaciada."""
+        nodo_actual = self.cabeza
+        clave = self.ESPACIO_CLAVES
+        while nodo_actual:
+            self._cambiar_clave(nodo_actual, clave)
+            clave += self.ESPACIO_CLAVES
+            nodo_actual = nodo_actual.siguiente
+        self.necesita_rebalanceo = False
+        self._registrar_cambio("rebalancear")
+    
+    def rebalancear(self):
+        """Redistribuye las claves de posición en una sola transacción."""
+        if not self.orden_por_posicion:
+            return
+        def operacion():
+            with self._transaccion():
+                self._redistribuir_claves()
+        self._escribir(operacion)
+    
+    def insertar_al_frente(self, vuelo: Vuelo):
+        """Añade un vuelo al inicio de la lista (para emergencias)."""
+        def operacion():
+            with self._transaccion():
+                self._persistir_nuevo(vuelo)
+                self._enlazar(self._nuevo_nodo(vuelo), None)
+        self._escribir(operacion)
+        return vuelo
+    
+    def insertar_al_final(self, vuelo: Vuelo):
+        """Añade un vuelo al final de la lista (vuelos regulares)."""
+        def operacion():
+            with self._transaccion():
+                self._persistir_nuevo(vuelo)
+                self._enlazar(self._nuevo_nodo(vuelo), self.cola)
+        self._escribir(operacion)
         return vuelo
     
     def obtener_primero(self):
         """Retorna (sin remover) el primer vuelo de la lista."""
-        if self.cabeza is None:
-            return None
-        return self.cabeza.vuelo
+        self._refrescar()
+        with self._lock.lectura():
+            nodo = self.cabeza
+        return nodo.vuelo if nodo else None
     
     def obtener_ultimo(self):
         """Retorna (sin remover) el último vuelo de la lista."""
-        if self.cola is None:
-            return None
-        return self.cola.vuelo
+        self._refrescar()
+        with self._lock.lectura():
+            nodo = self.cola
+        return nodo.vuelo if nodo else None
+    
+    def version_actual(self) -> int:
+        """Retorna la versión de la lista; cambia con cada mutación confirmada."""
+        self._refrescar()
+        return self.version
     
     def longitud(self):
         """Retorna el número total de vuelos en la lista."""
-        return self.size
+        self._refrescar()
+        with self._lock.lectura():
+            return self.size
     
     def insertar_en_posicion(self, vuelo: Vuelo, posicion: int):
         """Inserta un vuelo en una posición específica (ej: índice 2)."""
-        if posicion < 0 or posicion > self.size:
-            raise ValueError(f"Posición {posicion} fuera de rango (0-{self.size})")
-        
-        if posicion == 0:
-            return self.insertar_al_frente(vuelo)
-        elif posicion == self.size:
-            return self.insertar_al_final(vuelo)
-        
-        nuevo_nodo = Nodo(vuelo)
-        actual = self.cabeza
-        
-        # Avanzar hasta la posición deseada
-        for _ in range(posicion):
-            actual = actual.siguiente
-        
-        # Insertar entre actual.anterior y actual
-        nuevo_nodo.anterior = actual.anterior
-        nuevo_nodo.siguiente = actual
-        
-        # Actualizar referencias en BD
-        self._actualizar_bd(vuelo, 
-                          anterior_id=actual.anterior.vuelo.id,
-                          siguiente_id=actual.vuelo.id)
-        self._actualizar_bd(actual.anterior.vuelo, siguiente_id=vuelo.id)
-        self._actualizar_bd(actual.vuelo, anterior_id=vuelo.id)
-        
-        # Actualizar enlaces de los nodos
-        actual.anterior.siguiente = nuevo_nodo
-        actual.anterior = nuevo_nodo
-        
-        self.size += 1
+        def operacion():
+            if posicion < 0 or posicion > self.size:
+                raise ValueError(f"Posición {posicion} fuera de rango (0-{self.size})")
+            
+            with self._transaccion():
+                self._persistir_nuevo(vuelo)
+                anterior = self._nodo_en_posicion(posicion - 1) if posicion > 0 else None
+                self._enlazar(self._nuevo_nodo(vuelo), anterior)
+        self._escribir(operacion)
         return vuelo
     
     def extraer_de_posicion(self, posicion: int):
         """Remueve y retorna el vuelo en la posición dada (ej: cancelación)."""
-        if posicion < 0 or posicion >= self.size:
-            raise ValueError(f"Posición {posicion} fuera de rango (0-{self.size-1})")
-        
-        vuelo_extraido = None
-        
-        if posicion == 0:
-            # Extracción al inicio
-            nodo_extraido = self.cabeza
-            vuelo_extraido = nodo_extraido.vuelo
+        def operacion():
+            if posicion < 0 or posicion >= self.size:
+                raise ValueError(f"Posición {posicion} fuera de rango (0-{self.size-1})")
             
-            self.cabeza = nodo_extraido.siguiente
+            with self._transaccion():
+                nodo = self._nodo_en_posicion(posicion)
+                self._desenlazar(nodo)
+            return nodo
+        return self._escribir(operacion).vuelo
+    
+    def obtener_por_id(self, vuelo_id: int) -> Optional[Vuelo]:
+        """Retorna el vuelo con ese id si está en la lista."""
+        self._refrescar()
+        with self._lock.lectura():
+            nodo = self._nodos_por_id.get(vuelo_id)
+        return nodo.vuelo if nodo else None
+    
+    def obtener_por_codigo(self, codigo: str) -> Optional[Vuelo]:
+        """Retorna el vuelo con ese código si está en la lista."""
+        self._refrescar()
+        with self._lock.lectura():
+            nodo = self._indice_codigos().get(codigo)
+        return nodo.vuelo if nodo else None
+    
+    def posicion_de(self, vuelo_id: int) -> Optional[int]:
+        """Retorna la posición actual del vuelo o None si no está en la lista."""
+        self._refrescar()
+        with self._lock.lectura():
+            nodo = self._nodos_por_id.get(vuelo_id)
+            return self._posicion_de(nodo) if nodo else None
+    
+    def extraer_por_id(self, vuelo_id: int) -> Optional[Vuelo]:
+        """Remueve y retorna el vuelo con ese id, sin recorrer la lista."""
+        def operacion():
+            nodo = self._nodos_por_id.get(vuelo_id)
+            if nodo is None:
+                return None
             
-            if self.cabeza:
-                self.cabeza.anterior = None
-                self._actualizar_bd(self.cabeza.vuelo, anterior_id=None)
-            else:
-                self.cola = None
-                
-            self._actualizar_bd(vuelo_extraido, anterior_id=None, siguiente_id=None)
-        
-        elif posicion == self.size - 1:
-            # Extracción al final
-            nodo_extraido = self.cola
-            vuelo_extraido = nodo_extraido.vuelo
+            with self._transaccion():
+                self._desenlazar(nodo)
+            return nodo
+        nodo = self._escribir(operacion)
+        return nodo.vuelo if nodo else None
+    
+    def mover(self, vuelo_id: int, posicion: int) -> Optional[Vuelo]:
+        """Mueve el vuelo con ese id a la posición dada."""
+        def operacion():
+            nodo = self._nodos_por_id.get(vuelo_id)
+            if nodo is None:
+                return None
+            if posicion < 0 or posicion >= self.size:
+                raise ValueError(f"Posición {posicion} fuera de rango (0-{self.size-1})")
             
-            self.cola = nodo_extraido.anterior
+            with self._transaccion():
+                self._desenlazar(nodo)
+                anterior = self._nodo_en_posicion(posicion - 1) if posicion > 0 else None
+                self._enlazar(nodo, anterior)
+            return nodo
+        nodo = self._escribir(operacion)
+        return nodo.vuelo if nodo else None
+    
+    def actualizar_vuelo(self, vuelo_id: int, **campos) -> Optional[Vuelo]:
+        """Actualiza columnas de un vuelo en cola (p. ej. estado u hora) sin moverlo en la lista."""
+        def operacion():
+            nodo = self._nodos_por_id.get(vuelo_id)
+            if nodo is None:
+                return None
             
-            if self.cola:
-                self.cola.siguiente = None
-                self._actualizar_bd(self.cola.vuelo, siguiente_id=None)
+            with self._transaccion():
+                self._modificar_vuelo(nodo, campos)
+            return nodo
+        nodo = self._escribir(operacion)
+        return nodo.vuelo if nodo else None
+    
+    def obtener_proximo_prioritario(self) -> Optional[Vuelo]:
+        """Retorna el vuelo con mayor prioridad según el planificador (emergencias y hora)."""
+        if self.planificador is None:
+            raise ValueError("La lista no tiene planificador por prioridad")
+        self._refrescar()
+        with self._lock.lectura():
+            vuelo_id = self.planificador.proximo()
+            nodo = self._nodos_por_id.get(vuelo_id) if vuelo_id is not None else None
+        return nodo.vuelo if nodo else None
+    
+    def vuelos_en_ventana(self, desde: datetime, hasta: datetime) -> List[Vuelo]:
+        """Retorna los vuelos en cola con hora entre `desde` y `hasta` (inclusive), por hora."""
+        if self.indice_horario is None:
+            # Sin índice en memoria: consulta sobre el índice de Vuelo.hora
+            with self.fabrica_sesiones() as session:
+                return (
+                    session.query(Vuelo)
+                    .filter(Vuelo.en_cola == True, Vuelo.hora >= desde, Vuelo.hora <= hasta)
+                    .order_by(Vuelo.hora, Vuelo.id)
+                    .all()
+                )
+        
+        self._refrescar()
+        with self._lock.lectura():
+            nodos = [self._nodos_por_id[vuelo_id] for vuelo_id in self.indice_horario.ventana(desde, hasta)]
+        return [nodo.vuelo for nodo in nodos]
+    
+    def vuelos_por_origen(self, origen: str) -> List[Vuelo]:
+        """Retorna los vuelos en cola que salen de `origen`, en el orden de la lista."""
+        return self._vuelos_de_aeropuerto(Vuelo.origen, "por_origen", origen)
+    
+    def vuelos_por_destino(self, destino: str) -> List[Vuelo]:
+        """Retorna los vuelos en cola que llegan a `destino`, en el orden de la lista."""
+        return self._vuelos_de_aeropuerto(Vuelo.destino, "por_destino", destino)
+    
+    def _vuelos_de_aeropuerto(self, columna, grupos: str, aeropuerto: str) -> List[Vuelo]:
+        self._refrescar()
+        if self.indice_aeropuertos is None:
+            # Sin índice en memoria: ids desde el índice de la columna en BD
+            with self.fabrica_sesiones() as session:
+                ids = [fila.id for fila in session.query(Vuelo.id).filter(Vuelo.en_cola == True, columna == aeropuerto)]
+        
+        with self._lock.lectura():
+            if self.indice_aeropuertos is None:
+                nodos = [self._nodos_por_id[vuelo_id] for vuelo_id in ids if vuelo_id in self._nodos_por_id]
             else:
-                self.cabeza = None
-                
-            self._actualizar_bd(vuelo_extraido, anterior_id=None, siguiente_id=None)
+                ids = getattr(self.indice_aeropuertos, grupos).get(aeropuerto, ())
+                nodos = [self._nodos_por_id[vuelo_id] for vuelo_id in ids]
+            nodos = self._ordenar_por_posicion(nodos)
         
-        else:
-            # Extracción en medio
-            actual = self.cabeza
-            for _ in range(posicion):
-                actual = actual.siguiente
-            
-            nodo_extraido = actual
-            vuelo_extraido = nodo_extraido.vuelo
-            
-            actual.anterior.siguiente = actual.siguiente
-            actual.siguiente.anterior = actual.anterior
-            
-            # Actualizar referencias en BD
-            self._actualizar_bd(actual.anterior.vuelo, siguiente_id=actual.siguiente.vuelo.id)
-            self._actualizar_bd(actual.siguiente.vuelo, anterior_id=actual.anterior.vuelo.id)
-            self._actualizar_bd(vuelo_extraido, anterior_id=None, siguiente_id=None)
+        self._hidratar(nodos)
+        return [nodo.vuelo for nodo in nodos]
+    
+    def _ordenar_por_posicion(self, nodos: List[Nodo]) -> List[Nodo]:
+        """Ordena nodos de la lista según su posición: O(k log k · log n) con índice."""
+        if self._indice:
+            return sorted(nodos, key=self._indice.posicion_de)
         
-        self.size -= 1
-        return vuelo_extraido
+        # Sin índice, un solo recorrido filtrando los nodos pedidos
+        pedidos = {nodo.id for nodo in nodos}
+        ordenados = []
+        nodo = self.cabeza
+        while nodo and len(ordenados) < len(pedidos):
+            if nodo.id in pedidos:
+                ordenados.append(nodo)
+            nodo = nodo.siguiente
+        return ordenados
     
     def listar_todos(self):
         """Retorna una lista ordenada de todos los vuelos."""
-        vuelos = []
-        nodo_actual = self.cabeza
+        self._refrescar()
+        nodos = []
+        with self._lock.lectura():
+            nodo_actual = self.cabeza
+            while nodo_actual:
+                nodos.append(nodo_actual)
+                nodo_actual = nodo_actual.siguiente
         
-        while nodo_actual:
-            vuelos.append(nodo_actual.vuelo)
-            nodo_actual = nodo_actual.siguiente
+        self._hidratar(nodos)
+        return [nodo.vuelo for nodo in nodos]
+    
+    def recorrer(self, despues_de: Optional[int] = None, offset: int = 0,
+                 limite: Optional[int] = None, bloque: int = 500) -> Iterator[Vuelo]:
+        """Genera los vuelos en orden, empezando tras el vuelo `despues_de` (cursor)
+        y saltando `offset` posiciones; como máximo `limite` vuelos.
+
+        Los vuelos se cargan de a `bloque` mientras se recorre `Nodo.siguiente`.
+        El lock de lectura se toma por bloque, así un cliente lento no frena
+        las escrituras; si el siguiente nodo es extraído entre bloques el
+        recorrido termina ahí.
+        """
+        self._refrescar()
+        with self._lock.lectura():
+            inicio = offset
+            if despues_de is not None:
+                if despues_de not in self._nodos_por_id:
+                    raise ValueError(f"El vuelo {despues_de} no está en la lista")
+                inicio += self._posicion_de(self._nodos_por_id[despues_de]) + 1
             
-        return vuelos
+            nodo = self._nodo_en_posicion(inicio) if inicio < self.size else None
+            restantes = self.size if limite is None else limite
+        return self._recorrer_desde(nodo, restantes, bloque)
     
-    def reordenar(self, orden_ids: List[int]):
-        """Reordena la lista según un nuevo orden de IDs."""
-        if len(orden_ids) != self.size:
-            raise ValueError("La cantidad de IDs no coincide con el tamaño de la lista")
+    def _recorrer_desde(self, nodo: Optional[Nodo], restantes: int, bloque: int) -> Iterator[Vuelo]:
+        while nodo and restantes > 0:
+            nodos = []
+            with self._lock.lectura():
+                if self._nodos_por_id.get(nodo.id) is not nodo:
+                    return
+                while nodo and len(nodos) < min(bloque, restantes):
+                    nodos.append(nodo)
+                    nodo = nodo.siguiente
+            restantes -= len(nodos)
+            
+            self._hidratar(nodos)
+            for actual in nodos:
+                yield actual.vuelo
+    
+    def _reemplazar_tramo(self, viejos: List[Nodo], nuevos: List[Nodo], posicion: int):
+        """Reemplaza un tramo contiguo de nodos por los mismos nodos en otro orden.
+
+        Solo se registran en BD los vuelos cuyos vecinos realmente cambian.
+        """
+        antes = viejos[0].anterior
+        despues = viejos[-1].siguiente
+        vecinos_previos = {
+            nodo.id: (nodo.anterior, nodo.siguiente) for nodo in viejos
+        }
         
-        # Crear una lista nueva basada en el orden proporcionado
-        vuelos = {}
-        nodo_actual = self.cabeza
+        if self._indice:
+            for nodo in viejos:
+                self._indice.remover(nodo)
         
-        # Construir un diccionario con todos los vuelos
-        while nodo_actual:
-            vuelos[nodo_actual.vuelo.id] = nodo_actual.vuelo
+        # Calcular los nuevos vecinos en memoria
+        anterior = antes
+        for nodo in nuevos:
+            nodo.anterior = anterior
+            if anterior:
+                anterior.siguiente = nodo
+            else:
+                self.cabeza = nodo
+            anterior = nodo
+        anterior.siguiente = despues
+        if despues:
+            despues.anterior = anterior
+        else:
+            self.cola = anterior
+        
+        if self._indice:
+            for desplazamiento, nodo in enumerate(nuevos):
+                self._indice.insertar(nodo, posicion + desplazamiento)
+        
+        if self._cambios is not None:
+            self._registrar_cambio("reordenar", posicion=posicion, ids=[nodo.id for nodo in nuevos])
+        if self.orden_por_posicion:
+            # Las claves previas se restauran con sus propias acciones de deshacer
+            if self._pendientes is not None:
+                self._asignar_claves(nuevos)
+            if self._deshacer is not None:
+                self._deshacer.append(lambda: self._reemplazar_tramo(nuevos, viejos, posicion))
+            return
+        
+        # Registrar solo los punteros que cambiaron
+        for nodo in nuevos:
+            if vecinos_previos[nodo.id] != (nodo.anterior, nodo.siguiente):
+                self._actualizar_bd(nodo.id,
+                                    anterior_id=nodo.anterior.id if nodo.anterior else None,
+                                    siguiente_id=nodo.siguiente.id if nodo.siguiente else None)
+        if antes:
+            self._actualizar_bd(antes.id, siguiente_id=nuevos[0].id)
+        if despues:
+            self._actualizar_bd(despues.id, anterior_id=nuevos[-1].id)
+        
+        if self._deshacer is not None:
+            self._deshacer.append(lambda: self._reemplazar_tramo(nuevos, viejos, posicion))
+    
+    def reordenar(self, orden_ids: List[int], desde: Optional[int] = None):
+        """Reordena la lista según un nuevo orden de IDs.
+
+        Sin `desde`, `orden_ids` debe contener todos los vuelos de la lista.
+        Con `desde`, reordena solo el tramo de len(orden_ids) vuelos que
+        empieza en esa posición. En ambos casos se reescribe únicamente el
+        segmento que cambió, en una sola transacción.
+        """
+        self._escribir(lambda: self._reordenar(orden_ids, desde))
+        return self.listar_todos()
+    
+    def _reordenar(self, orden_ids: List[int], desde: Optional[int]):
+        if desde is None:
+            if len(orden_ids) != self.size:
+                raise ValueError("La cantidad de IDs no coincide con el tamaño de la lista")
+            desde = 0
+        elif desde < 0 or desde + len(orden_ids) > self.size:
+            raise ValueError(f"El tramo {desde}-{desde + len(orden_ids) - 1} está fuera de rango (0-{self.size-1})")
+        
+        if not orden_ids:
+            return
+        
+        # Recolectar los nodos del tramo actual
+        actuales = []
+        nodo_actual = self._nodo_en_posicion(desde)
+        for _ in range(len(orden_ids)):
+            actuales.append(nodo_actual)
             nodo_actual = nodo_actual.siguiente
+        nodos = {nodo.id: nodo for nodo in actuales}
         
-        # Verificar que todos los IDs existan
-        if not all(id in vuelos for id in orden_ids):
+        # Verificar que los IDs no se repitan y que todos existan
+        if len(set(orden_ids)) != len(orden_ids):
+            raise ValueError("El nuevo orden tiene IDs repetidos")
+        if not all(id in nodos for id in orden_ids):
             raise ValueError("Uno o más IDs proporcionados no existen en la lista")
         
-        # Vaciar la lista actual
-        self.cabeza = None
-        self.cola = None
-        self.size = 0
+        # Descartar el prefijo y el sufijo que no cambian
+        inicio = 0
+        while inicio < len(orden_ids) and actuales[inicio].id == orden_ids[inicio]:
+            inicio += 1
+        if inicio == len(orden_ids):
+            return
+        fin = len(orden_ids)
+        while actuales[fin - 1].id == orden_ids[fin - 1]:
+            fin -= 1
         
-        # Reconstruir la lista con el nuevo orden
-        for id in orden_ids:
-            self.insertar_al_final(vuelos[id])
-            
-        return self.listar_todos()
\ No newline at end of file
+        with self._transaccion():
+            self._reemplazar_tramo(actuales[inicio:fin],
+                                   [nodos[id] for id in orden_ids[inicio:fin]],
+                                   desde + inicio)
@@ -0,0 +1,116 @@
+"""Benchmark de creación de misiones en tarea1: una por request vs. carga masiva.
+
+Uso:
+    python benchmark_tarea1.py [filas_individuales] [filas_masivas]
+    python benchmark_tarea1.py planes    # verifica el índice de la cola con EXPLAIN QUERY PLAN
+"""
+import json
+import os
+import sys
+import tempfile
+import time
+
+# tarea1 usa ./rpg6.db: trabajar en un directorio temporal
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+os.chdir(tempfile.mkdtemp())
+
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine, text
+from sqlalchemy.dialects import sqlite
+
+import tarea1
+
+
+def mision(i: int) -> dict:
+    return {"nombre": f"Mision {i}", "descripcion": "Generada por el benchmark", "experiencia": i % 100}
+
+
+def medir(descripcion: str, filas: int, funcion):
+    inicio = time.perf_counter()
+    funcion()
+    transcurrido = time.perf_counter() - inicio
+    print(f"{descripcion:<30} {filas:>8} filas {transcurrido:>8.2f}s {filas / transcurrido:>10.0f} filas/s")
+
+
+def main(individuales: int = 1000, masivas: int = 100000):
+    def una_por_request():
+        for i in range(individuales):
+            cliente.post("/misiones", json=mision(i))
+
+    def arreglo_json():
+        respuesta = cliente.post("/misiones:batch", json=[mision(i) for i in range(masivas)])
+        assert len(respuesta.json()["ids"]) == masivas
+
+    def ndjson():
+        cuerpo = "".join(json.dumps(mision(i)) + "\n" for i in range(masivas))
+        respuesta = cliente.post("/misiones:batch", content=cuerpo,
+                                 headers={"content-type": "application/x-ndjson"})
+        assert len(respuesta.json()["ids"]) == masivas
+
+    # El contexto ejecuta el startup de la app (creación de tablas)
+    with TestClient(tarea1.app) as cliente:
+        medir("POST /misiones", individuales, una_por_request)
+        medir("POST /misiones:batch (JSON)", masivas, arreglo_json)
+        medir("POST /misiones:batch (NDJSON)", masivas, ndjson)
+
+
+# Esquema de rpg6.db antes de las columnas e índices que agrega asegurar_esquema
+ESQUEMA_ORIGINAL = [
+    "CREATE TABLE misiones (id INTEGER NOT NULL PRIMARY KEY, nombre VARCHAR(50) NOT NULL, "
+    "descripcion TEXT, experiencia INTEGER, estado VARCHAR(10), fecha_creacion DATETIME)",
+    "CREATE TABLE personajes (id INTEGER NOT NULL PRIMARY KEY, nombre VARCHAR(30) NOT NULL)",
+    "CREATE TABLE misiones_personaje (personaje_id INTEGER NOT NULL REFERENCES personajes (id), "
+    "mision_id INTEGER NOT NULL REFERENCES misiones (id), orden INTEGER, "
+    "PRIMARY KEY (personaje_id, mision_id))",
+]
+
+INDICE_COLA = "SEARCH misiones_personaje USING INDEX ix_misiones_personaje_personaje_id_orden"
+
+
+def consultas_cola() -> dict:
+    """Consultas de la cola que deben resolverse con el índice (personaje_id, orden)."""
+    cola = tarea1.ColaMisiones(1, None)
+    return {
+        "first": cola._consulta_first(),
+        "dequeue": tarea1.delete(tarea1.MisionPersonaje).where(
+            tarea1.MisionPersonaje.personaje_id == 1,
+            tarea1.MisionPersonaje.mision_id == cola._consulta_cabeza().scalar_subquery(),
+        ),
+        "listado": tarea1.consulta_cola(1, None).limit(100),
+        "listado con cursor": tarea1.consulta_cola(1, 500).limit(100),
+    }
+
+
+def verificar_planes(conexion, descripcion: str):
+    for nombre, consulta in consultas_cola().items():
+        sql = str(consulta.compile(dialect=sqlite.dialect(), compile_kwargs={"literal_binds": True}))
+        plan = [fila[-1] for fila in conexion.execute(text(f"EXPLAIN QUERY PLAN {sql}"))]
+        assert any(paso.startswith(INDICE_COLA) for paso in plan), f"{descripcion}, {nombre}: {plan}"
+        assert not any("TEMP B-TREE" in paso for paso in plan), f"{descripcion}, {nombre}: {plan}"
+        print(f"{descripcion:<10} {nombre:<20} {INDICE_COLA}")
+
+
+def planes():
+    """Comprueba los planes en una BD nueva y en una rpg6.db con el esquema original migrada."""
+    nueva = create_engine("sqlite:///nueva.db")
+    with nueva.begin() as conexion:
+        tarea1.Base.metadata.create_all(conexion)
+        tarea1.asegurar_esquema(conexion)
+        verificar_planes(conexion, "nueva")
+
+    migrada = create_engine("sqlite:///migrada.db")
+    with migrada.begin() as conexion:
+        for sentencia in ESQUEMA_ORIGINAL:
+            conexion.execute(text(sentencia))
+    # Los mismos pasos que el startup de tarea1
+    with migrada.begin() as conexion:
+        tarea1.Base.metadata.create_all(conexion)
+        tarea1.asegurar_esquema(conexion)
+        verificar_planes(conexion, "migrada")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "planes":
+        planes()
+    else:
+        main(*(int(arg) for arg in sys.argv[1:3]))
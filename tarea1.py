@@ -1,14 +1,56 @@
-from fastapi import FastAPI, HTTPException
-from pydantic import BaseModel
-from sqlalchemy import create_engine, Column, Integer, String, Text, Enum, DateTime, ForeignKey
-from sqlalchemy.orm import sessionmaker, declarative_base, relationship
+from fastapi import FastAPI, HTTPException, Body, Query, Request
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, ValidationError
+from sqlalchemy import event, Column, Integer, String, Text, Enum, DateTime, ForeignKey, Index, inspect, text, update, delete, select, insert
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from sqlalchemy.orm import declarative_base, relationship
+from typing import List, Literal, Optional
+from collections import OrderedDict
 from datetime import datetime
 import enum
+import json
+import os
+import threading
+import time
 
 # Configuración de la base de datos
-DATABASE_URL = "sqlite:///./rpg6.db"
-engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
-SessionLocal = sessionmaker(bind=engine)
+DATABASE_URL = "sqlite+aiosqlite:///./rpg6.db"
+# Conexiones abiertas a la vez; las demás requests esperan su turno sin ocupar hilos
+DB_TRABAJADORES = int(os.environ.get("DB_TRABAJADORES", 40))
+
+def crear_engine(url: str, trabajadores: int = DB_TRABAJADORES, wal: bool = True,
+                 synchronous: str = "NORMAL", mmap_size: int = 256 * 1024 * 1024,
+                 cache_size_kib: int = 64 * 1024, busy_timeout_ms: int = 30000):
+    """Crea un engine asíncrono de SQLite con WAL y pragmas aplicados en cada conexión nueva.
+
+    El busy_timeout es amplio porque muchas requests pendientes pueden
+    quedar esperando el único lock de escritura de SQLite.
+    """
+    argumentos = {"connect_args": {"timeout": busy_timeout_ms / 1000}}
+    en_memoria = url.split("://", 1)[1] in ("", "/:memory:")
+    if not en_memoria:
+        argumentos.update(pool_size=trabajadores, max_overflow=0)
+    engine = create_async_engine(url, **argumentos)
+
+    @event.listens_for(engine.sync_engine, "connect")
+    def configurar_conexion(conexion_dbapi, _registro):
+        cursor = conexion_dbapi.cursor()
+        if wal and not en_memoria:
+            cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute(f"PRAGMA synchronous={synchronous}")
+        cursor.execute(f"PRAGMA mmap_size={mmap_size}")
+        # Un valor negativo indica el tamaño en KiB en lugar de páginas
+        cursor.execute(f"PRAGMA cache_size=-{cache_size_kib}")
+        cursor.execute(f"PRAGMA busy_timeout={busy_timeout_ms}")
+        cursor.close()
+
+    return engine
+
+engine = crear_engine(DATABASE_URL)
+# Los objetos siguen legibles después del commit, sin recargas implícitas
+SessionLocal = async_sessionmaker(engine, expire_on_commit=False)
 Base = declarative_base()
 
 # Enumeración para el estado de la misión
@@ -32,11 +74,27 @@ class Personaje(Base):
     __tablename__ = 'personajes'
     id = Column(Integer, primary_key=True)
     nombre = Column(String(30), nullable=False)
+    # Último orden asignado en su cola; se incrementa al aceptar una misión
+    ultimo_orden = Column(Integer, nullable=False, default=0, server_default="0")
+    # Cantidad de misiones en su cola, mantenida por enqueue/dequeue
+    tamano_cola = Column(Integer, nullable=False, default=0, server_default="0")
+    # Totales materializados al completar misiones (ver ColaMisiones.dequeue)
+    experiencia_total = Column(Integer, nullable=False, default=0, server_default="0")
+    nivel = Column(Integer, nullable=False, default=1, server_default="1")
+    # El ranking recorre este índice en orden: más experiencia primero y,
+    # en un empate, el personaje más antiguo (menor id)
+    __table_args__ = (
+        Index("ix_personajes_ranking", experiencia_total.desc(), "id"),
+    )
 
     misiones = relationship("MisionPersonaje", back_populates="personaje")
 
 class MisionPersonaje(Base):
     __tablename__ = 'misiones_personaje'
+    # La cola se consulta siempre por personaje y en orden
+    __table_args__ = (
+        Index("ix_misiones_personaje_personaje_id_orden", "personaje_id", "orden"),
+    )
     personaje_id = Column(Integer, ForeignKey('personajes.id'), primary_key=True)
     mision_id = Column(Integer, ForeignKey('misiones.id'), primary_key=True)
     orden = Column(Integer)
@@ -44,8 +102,108 @@ class MisionPersonaje(Base):
     personaje = relationship("Personaje", back_populates="misiones")
     mision = relationship("Mision", back_populates="personajes")
 
-# Crear tablas
-Base.metadata.create_all(bind=engine)
+class HistorialMision(Base):
+    """Registro de cada misión completada por un personaje."""
+    __tablename__ = 'historial_misiones'
+    id = Column(Integer, primary_key=True)
+    personaje_id = Column(Integer, ForeignKey('personajes.id'), nullable=False, index=True)
+    mision_id = Column(Integer, ForeignKey('misiones.id'), nullable=False)
+    experiencia = Column(Integer, nullable=False, default=0)
+    fecha = Column(DateTime, default=datetime.utcnow)
+
+# Experiencia necesaria para subir cada nivel
+EXPERIENCIA_POR_NIVEL = 100
+
+def asegurar_esquema(conexion):
+    """Agrega a una BD existente las columnas e índices que create_all no añade."""
+    columnas = {c["name"] for c in inspect(conexion).get_columns("personajes")}
+
+    if "ultimo_orden" not in columnas:
+        conexion.execute(text("ALTER TABLE personajes ADD COLUMN ultimo_orden INTEGER NOT NULL DEFAULT 0"))
+        # Continuar desde el mayor orden ya usado por cada personaje
+        conexion.execute(text(
+            "UPDATE personajes SET ultimo_orden = COALESCE("
+            "(SELECT MAX(orden) FROM misiones_personaje WHERE personaje_id = personajes.id), 0)"
+        ))
+    if "tamano_cola" not in columnas:
+        conexion.execute(text("ALTER TABLE personajes ADD COLUMN tamano_cola INTEGER NOT NULL DEFAULT 0"))
+        conexion.execute(text(
+            "UPDATE personajes SET tamano_cola = "
+            "(SELECT COUNT(*) FROM misiones_personaje WHERE personaje_id = personajes.id)"
+        ))
+    if "experiencia_total" not in columnas:
+        conexion.execute(text("ALTER TABLE personajes ADD COLUMN experiencia_total INTEGER NOT NULL DEFAULT 0"))
+    if "nivel" not in columnas:
+        conexion.execute(text("ALTER TABLE personajes ADD COLUMN nivel INTEGER NOT NULL DEFAULT 1"))
+    # Reemplazado por ix_personajes_ranking, que ordena los empates por id ascendente
+    conexion.execute(text("DROP INDEX IF EXISTS ix_personajes_experiencia_total_id"))
+    conexion.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_personajes_ranking "
+        "ON personajes (experiencia_total DESC, id)"
+    ))
+    conexion.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_misiones_personaje_personaje_id_orden "
+        "ON misiones_personaje (personaje_id, orden)"
+    ))
+
+# Caché en proceso del tamaño de las colas
+class CacheTamanos:
+    """Caché LRU con vencimiento de tamaños de cola por personaje.
+
+    Las escrituras de la cola invalidan la entrada del personaje; el TTL
+    acota cuánto puede atrasarse respecto de otros procesos. Cada
+    invalidación incrementa la generación del personaje, y `guardar` ignora
+    valores leídos antes de una invalidación posterior.
+    """
+
+    def __init__(self, capacidad: int = 10000, ttl: float = 2.0):
+        self.capacidad = capacidad
+        self.ttl = ttl
+        self._entradas = OrderedDict()
+        self._generaciones = {}
+        self._lock = threading.Lock()
+
+    def obtener(self, personaje_id: int):
+        with self._lock:
+            entrada = self._entradas.get(personaje_id)
+            if entrada is None:
+                return None
+            valor, vence = entrada
+            if time.monotonic() >= vence:
+                del self._entradas[personaje_id]
+                return None
+            self._entradas.move_to_end(personaje_id)
+            return valor
+
+    def generacion(self, personaje_id: int) -> int:
+        """Generación actual del personaje; se toma antes de leer el valor en BD."""
+        with self._lock:
+            return self._generaciones.get(personaje_id, 0)
+
+    def guardar(self, personaje_id: int, valor: int, generacion: int):
+        if self.ttl <= 0:
+            return
+        with self._lock:
+            if self._generaciones.get(personaje_id, 0) != generacion:
+                # Una escritura confirmó después de leer el valor
+                return
+            self._entradas[personaje_id] = (valor, time.monotonic() + self.ttl)
+            self._entradas.move_to_end(personaje_id)
+            if len(self._entradas) > self.capacidad:
+                self._entradas.popitem(last=False)
+
+    def invalidar(self, personaje_id: int):
+        with self._lock:
+            self._entradas.pop(personaje_id, None)
+            self._generaciones[personaje_id] = self._generaciones.get(personaje_id, 0) + 1
+
+cache_tamanos = CacheTamanos()
+
+# Resultado de completar una misión (independiente de la sesión)
+class MisionCompletada(BaseModel):
+    id: int
+    nombre: str
+    experiencia: int
 
 # TDA Cola de Misiones
 class ColaMisiones:
@@ -53,32 +211,165 @@ class ColaMisiones:
         self.personaje_id = personaje_id
         self.db = db
 
-    def enqueue(self, mision_id: int):
-        total = self.db.query(MisionPersonaje).filter_by(personaje_id=self.personaje_id).count()
-        nueva = MisionPersonaje(personaje_id=self.personaje_id, mision_id=mision_id, orden=total + 1)
+    async def enqueue(self, mision_id: int):
+        """Encola la misión; retorna su orden o None si el personaje no existe.
+
+        Lanza LookupError si la misión no existe.
+        """
+        # Reservar el siguiente orden en la misma transacción que la inserción
+        orden = (await self.db.execute(
+            update(Personaje)
+            .where(Personaje.id == self.personaje_id)
+            .values(ultimo_orden=Personaje.ultimo_orden + 1,
+                    tamano_cola=Personaje.tamano_cola + 1)
+            .returning(Personaje.ultimo_orden)
+        )).scalar()
+        if orden is None:
+            await self.db.rollback()
+            return None
+        await self._verificar_misiones([mision_id])
+        nueva = MisionPersonaje(personaje_id=self.personaje_id, mision_id=mision_id, orden=orden)
         self.db.add(nueva)
-        self.db.commit()
+        await self.db.commit()
+        cache_tamanos.invalidar(self.personaje_id)
+        return orden
+
+    async def enqueue_many(self, mision_ids: List[int]):
+        """Encola varias misiones con órdenes contiguos en una sola transacción.
+
+        Retorna los órdenes asignados o None si el personaje no existe;
+        lanza LookupError si alguna misión no existe.
+        """
+        if not mision_ids:
+            existe = (await self.db.execute(
+                select(Personaje.id).where(Personaje.id == self.personaje_id)
+            )).scalar()
+            return [] if existe is not None else None
+        # Reservar el rango completo de órdenes con un solo UPDATE
+        ultimo = (await self.db.execute(
+            update(Personaje)
+            .where(Personaje.id == self.personaje_id)
+            .values(ultimo_orden=Personaje.ultimo_orden + len(mision_ids),
+                    tamano_cola=Personaje.tamano_cola + len(mision_ids))
+            .returning(Personaje.ultimo_orden)
+        )).scalar()
+        if ultimo is None:
+            await self.db.rollback()
+            return None
+        await self._verificar_misiones(mision_ids)
+        ordenes = list(range(ultimo - len(mision_ids) + 1, ultimo + 1))
+        await self.db.execute(insert(MisionPersonaje), [
+            {"personaje_id": self.personaje_id, "mision_id": mision_id, "orden": orden}
+            for mision_id, orden in zip(mision_ids, ordenes)
+        ])
+        await self.db.commit()
+        cache_tamanos.invalidar(self.personaje_id)
+        return ordenes
+
+    async def _verificar_misiones(self, mision_ids: List[int]):
+        """Lanza LookupError (tras revertir) si alguna misión no existe.
 
-    def dequeue(self):
-        primera = self.db.query(MisionPersonaje).filter_by(personaje_id=self.personaje_id).order_by(MisionPersonaje.orden).first()
-        if primera:
-            mision = self.db.query(Mision).get(primera.mision_id)
-            mision.estado = EstadoMision.completada
-            self.db.delete(primera)
-            self.db.commit()
-            return mision
-        return None
+        SQLite no hace cumplir la clave foránea: una fila huérfana en la cola
+        dejaría una cabeza sin misión.
+        """
+        existentes = set()
+        for inicio in range(0, len(mision_ids), TAMANO_LOTE):
+            bloque = mision_ids[inicio:inicio + TAMANO_LOTE]
+            existentes.update((await self.db.execute(select(Mision.id).where(Mision.id.in_(bloque)))).scalars())
+        faltantes = [mision_id for mision_id in mision_ids if mision_id not in existentes]
+        if faltantes:
+            await self.db.rollback()
+            raise LookupError(f"Misiones no encontradas: {faltantes[:20]}")
 
-    def first(self):
-        return self.db.query(Mision).join(MisionPersonaje).filter(
-            MisionPersonaje.personaje_id == self.personaje_id
-        ).order_by(MisionPersonaje.orden).first()
+    async def dequeue(self):
+        """Saca la primera misión de la cola, la marca completada y la retorna.
 
-    def is_empty(self):
-        return self.db.query(MisionPersonaje).filter_by(personaje_id=self.personaje_id).count() == 0
+        Las filas de la cola cuya misión ya no existe se descartan.
+        """
+        primera = self._consulta_cabeza().scalar_subquery()
+        descartadas = 0
+        while True:
+            mision_id = (await self.db.execute(
+                delete(MisionPersonaje)
+                .where(MisionPersonaje.personaje_id == self.personaje_id,
+                       MisionPersonaje.mision_id == primera)
+                .returning(MisionPersonaje.mision_id)
+            )).scalar()
+            if mision_id is None:
+                if not descartadas:
+                    await self.db.rollback()
+                    return None
+                await self._descontar(descartadas)
+                await self.db.commit()
+                cache_tamanos.invalidar(self.personaje_id)
+                return None
+            fila = (await self.db.execute(
+                update(Mision)
+                .where(Mision.id == mision_id)
+                .values(estado=EstadoMision.completada)
+                .returning(Mision.id, Mision.nombre, Mision.experiencia)
+            )).first()
+            if fila is not None:
+                break
+            descartadas += 1
+        if descartadas:
+            await self._descontar(descartadas)
+        experiencia = fila.experiencia or 0
+        # Acumular la experiencia y recalcular el nivel en la misma transacción
+        await self.db.execute(
+            update(Personaje)
+            .where(Personaje.id == self.personaje_id)
+            .values(tamano_cola=Personaje.tamano_cola - 1,
+                    experiencia_total=Personaje.experiencia_total + experiencia,
+                    nivel=1 + (Personaje.experiencia_total + experiencia) // EXPERIENCIA_POR_NIVEL)
+        )
+        await self.db.execute(insert(HistorialMision).values(
+            personaje_id=self.personaje_id, mision_id=mision_id, experiencia=experiencia
+        ))
+        await self.db.commit()
+        cache_tamanos.invalidar(self.personaje_id)
+        return MisionCompletada(id=fila.id, nombre=fila.nombre, experiencia=experiencia)
 
-    def size(self):
-        return self.db.query(MisionPersonaje).filter_by(personaje_id=self.personaje_id).count()
+    async def _descontar(self, cantidad: int):
+        """Resta del tamaño de la cola las filas huérfanas descartadas."""
+        await self.db.execute(
+            update(Personaje)
+            .where(Personaje.id == self.personaje_id)
+            .values(tamano_cola=Personaje.tamano_cola - cantidad)
+        )
+
+    async def first(self):
+        return (await self.db.execute(self._consulta_first())).scalars().first()
+
+    # Consultas de la cabeza de la cola (resueltas con ix_misiones_personaje_personaje_id_orden)
+    def _consulta_cabeza(self):
+        return (
+            select(MisionPersonaje.mision_id)
+            .where(MisionPersonaje.personaje_id == self.personaje_id)
+            .order_by(MisionPersonaje.orden)
+            .limit(1)
+        )
+
+    def _consulta_first(self):
+        return (
+            select(Mision).join(MisionPersonaje)
+            .where(MisionPersonaje.personaje_id == self.personaje_id)
+            .order_by(MisionPersonaje.orden)
+            .limit(1)
+        )
+
+    async def is_empty(self):
+        return await self.size() == 0
+
+    async def size(self):
+        tamano = cache_tamanos.obtener(self.personaje_id)
+        if tamano is None:
+            generacion = cache_tamanos.generacion(self.personaje_id)
+            tamano = (await self.db.execute(
+                select(Personaje.tamano_cola).where(Personaje.id == self.personaje_id)
+            )).scalar() or 0
+            cache_tamanos.guardar(self.personaje_id, tamano, generacion)
+        return tamano
 
 # Esquemas de entrada
 class PersonajeCreate(BaseModel):
@@ -89,69 +380,198 @@ class MisionCreate(BaseModel):
     descripcion: str
     experiencia: int
 
+# Esquemas de salida
+class MisionEnCola(BaseModel):
+    orden: int  # Cursor para pedir la página siguiente (?after=)
+    id: int
+    nombre: str
+    descripcion: Optional[str] = None
+    experiencia: Optional[int] = None
+    estado: Optional[EstadoMision] = None
+    fecha_creacion: Optional[datetime] = None
+
+class PersonajeRanking(BaseModel):
+    id: int
+    nombre: str
+    experiencia_total: int
+    nivel: int
+
+def consulta_cola(personaje_id: int, after: Optional[int]):
+    """Misiones en cola del personaje posteriores al orden `after`, en orden."""
+    consulta = (
+        select(MisionPersonaje.orden, Mision.id, Mision.nombre, Mision.descripcion,
+               Mision.experiencia, Mision.estado, Mision.fecha_creacion)
+        .join(Mision, Mision.id == MisionPersonaje.mision_id)
+        .where(MisionPersonaje.personaje_id == personaje_id)
+        .order_by(MisionPersonaje.orden)
+    )
+    if after is not None:
+        consulta = consulta.where(MisionPersonaje.orden > after)
+    return consulta
+
+# Carga masiva: filas por transacción
+TAMANO_LOTE = 1000
+
+async def leer_filas(request: Request):
+    """Genera los objetos de un cuerpo JSON (arreglo) o NDJSON, este último a medida que llega."""
+    if request.headers.get("content-type", "").startswith("application/x-ndjson"):
+        resto = b""
+        async for trozo in request.stream():
+            resto += trozo
+            *lineas, resto = resto.split(b"\n")
+            for linea in lineas:
+                if linea.strip():
+                    yield json.loads(linea)
+        if resto.strip():
+            yield json.loads(resto)
+    else:
+        filas = json.loads(await request.body())
+        if not isinstance(filas, list):
+            raise ValueError("Se esperaba un arreglo JSON")
+        for fila in filas:
+            yield fila
+
+async def insertar_lote(modelo, filas: List[dict]) -> List[int]:
+    """Inserta un lote con un executemany en su propia transacción y retorna los ids."""
+    async with engine.begin() as conexion:
+        # SQLite asigna ids crecientes en el orden de las filas dentro de la
+        # transacción: ordenarlos evita que SQLAlchemy inserte fila por fila
+        # para garantizar el orden de RETURNING (sort_by_parameter_order)
+        return sorted((await conexion.execute(insert(modelo).returning(modelo.id), filas)).scalars())
+
+async def crear_en_lotes(request: Request, modelo, esquema) -> List[int]:
+    """Valida las filas del cuerpo y las inserta de a TAMANO_LOTE."""
+    ids, lote = [], []
+    try:
+        async for fila in leer_filas(request):
+            lote.append(esquema(**fila).dict())
+            if len(lote) == TAMANO_LOTE:
+                ids += await insertar_lote(modelo, lote)
+                lote = []
+    except (ValueError, TypeError, ValidationError) as e:
+        # Los lotes anteriores ya quedaron confirmados
+        raise HTTPException(status_code=422, detail=f"Fila {len(ids) + len(lote) + 1} inválida "
+                                                    f"({len(ids)} filas insertadas): {e}")
+    if lote:
+        ids += await insertar_lote(modelo, lote)
+    return ids
+
 # Inicialización de FastAPI
 app = FastAPI()
 
+@app.on_event("startup")
+async def preparar_bd():
+    # Crear tablas y migrar una rpg6.db existente
+    async with engine.begin() as conexion:
+        await conexion.run_sync(Base.metadata.create_all)
+        await conexion.run_sync(asegurar_esquema)
+
+@app.on_event("shutdown")
+async def cerrar_bd():
+    await engine.dispose()
+
 # Endpoints
 @app.post("/personajes")
-def crear_personaje(personaje: PersonajeCreate):
-    db = SessionLocal()
-    nuevo = Personaje(nombre=personaje.nombre)
-    db.add(nuevo)
-    db.commit()
-    db.refresh(nuevo)
-    db.close()
+async def crear_personaje(personaje: PersonajeCreate):
+    async with SessionLocal() as db:
+        nuevo = Personaje(nombre=personaje.nombre)
+        db.add(nuevo)
+        await db.commit()
+        await db.refresh(nuevo)
     return nuevo
 
+@app.post("/personajes:batch")
+async def crear_personajes(request: Request):
+    return {"ids": await crear_en_lotes(request, Personaje, PersonajeCreate)}
+
 @app.post("/misiones")
-def crear_mision(mision: MisionCreate):
-    db = SessionLocal()
-    nueva = Mision(
-        nombre=mision.nombre,
-        descripcion=mision.descripcion,
-        experiencia=mision.experiencia
-    )
-    db.add(nueva)
-    db.commit()
-    db.refresh(nueva)
-    db.close()
+async def crear_mision(mision: MisionCreate):
+    async with SessionLocal() as db:
+        nueva = Mision(
+            nombre=mision.nombre,
+            descripcion=mision.descripcion,
+            experiencia=mision.experiencia
+        )
+        db.add(nueva)
+        await db.commit()
+        await db.refresh(nueva)
     return nueva
 
+@app.post("/misiones:batch")
+async def crear_misiones(request: Request):
+    return {"ids": await crear_en_lotes(request, Mision, MisionCreate)}
+
 @app.post("/personajes/{personaje_id}/misiones/{mision_id}")
-def aceptar_mision(personaje_id: int, mision_id: int):
-    db = SessionLocal()
-    cola = ColaMisiones(personaje_id, db)
-    cola.enqueue(mision_id)
-    db.close()
+async def aceptar_mision(personaje_id: int, mision_id: int):
+    async with SessionLocal() as db:
+        cola = ColaMisiones(personaje_id, db)
+        try:
+            orden = await cola.enqueue(mision_id)
+        except LookupError as e:
+            raise HTTPException(status_code=404, detail=str(e))
+    if orden is None:
+        raise HTTPException(status_code=404, detail="Personaje no encontrado")
     return {"mensaje": "Misión aceptada"}
 
+@app.post("/personajes/{personaje_id}/misiones:batch")
+async def aceptar_misiones(personaje_id: int, mision_ids: List[int] = Body(...)):
+    if len(set(mision_ids)) != len(mision_ids):
+        raise HTTPException(status_code=400, detail="Hay misiones repetidas")
+    async with SessionLocal() as db:
+        cola = ColaMisiones(personaje_id, db)
+        try:
+            ordenes = await cola.enqueue_many(mision_ids)
+        except LookupError as e:
+            raise HTTPException(status_code=404, detail=str(e))
+        except IntegrityError:
+            await db.rollback()
+            raise HTTPException(status_code=400, detail="Alguna misión ya está en la cola del personaje")
+    if ordenes is None:
+        raise HTTPException(status_code=404, detail="Personaje no encontrado")
+    return {"mensaje": f"{len(ordenes)} misiones aceptadas", "ordenes": ordenes}
+
 @app.post("/personajes/{personaje_id}/completar")
-def completar_mision(personaje_id: int):
-    db = SessionLocal()
-    cola = ColaMisiones(personaje_id, db)
-    mision = cola.dequeue()
-    db.close()
+async def completar_mision(personaje_id: int):
+    async with SessionLocal() as db:
+        cola = ColaMisiones(personaje_id, db)
+        mision = await cola.dequeue()
     if not mision:
         raise HTTPException(status_code=404, detail="No hay misiones en cola")
     return {"mensaje": f"Misión '{mision.nombre}' completada"}
 
-@app.get("/personajes/{personaje_id}/misiones")
-def listar_misiones(personaje_id: int):
-    db = SessionLocal()
-    misiones = (
-        db.query(Mision)
-        .join(MisionPersonaje)
-        .filter(MisionPersonaje.personaje_id == personaje_id)
-        .order_by(MisionPersonaje.orden)
-        .all()
-    )
-    db.close()
-    return misiones
+@app.get("/personajes/{personaje_id}/misiones", response_model=List[MisionEnCola])
+async def listar_misiones(
+    personaje_id: int,
+    after: Optional[int] = Query(None, description="Orden de la última misión de la página anterior"),
+    limit: int = Query(100, ge=1, le=1000),
+    formato: Literal["json", "ndjson"] = "json",
+):
+    if formato == "ndjson":
+        # Flujo completo desde el cursor, leyendo de a bloques
+        async def lineas():
+            async with SessionLocal() as db:
+                filas = await db.stream(consulta_cola(personaje_id, after).execution_options(yield_per=500))
+                async for fila in filas:
+                    yield json.dumps(jsonable_encoder(fila._asdict())) + "\n"
+        return StreamingResponse(lineas(), media_type="application/x-ndjson")
+
+    async with SessionLocal() as db:
+        filas = (await db.execute(consulta_cola(personaje_id, after).limit(limit))).all()
+    return [fila._asdict() for fila in filas]
 
 @app.get("/personajes/{personaje_id}/size")
-def obtener_tamano_cola(personaje_id: int):
-    db = SessionLocal()
-    cola = ColaMisiones(personaje_id, db)
-    tamano = cola.size()
-    db.close()
-    return {"personaje_id": personaje_id, "tamano_cola": tamano}
\ No newline at end of file
+async def obtener_tamano_cola(personaje_id: int):
+    async with SessionLocal() as db:
+        cola = ColaMisiones(personaje_id, db)
+        tamano = await cola.size()
+    return {"personaje_id": personaje_id, "tamano_cola": tamano}
+
+@app.get("/ranking", response_model=List[PersonajeRanking])
+async def obtener_ranking(limit: int = Query(10, ge=1, le=100)):
+    async with SessionLocal() as db:
+        filas = (await db.execute(
+            select(Personaje.id, Personaje.nombre, Personaje.experiencia_total, Personaje.nivel)
+            .order_by(Personaje.experiencia_total.desc(), Personaje.id)
+            .limit(limit)
+        )).all()
+    return [fila._asdict() for fila in filas]